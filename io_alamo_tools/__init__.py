@@ -14,6 +14,7 @@ if "bpy" in locals():
     importlib.reload(export_ala)
     importlib.reload(settings)
     importlib.reload(utils)
+    importlib.reload(chunk_reader)
 else:
     from . import import_alo
     from . import import_ala
@@ -21,6 +22,7 @@ else:
     from . import export_ala
     from . import settings
     from . import utils
+    from . import chunk_reader
 
 import bpy
 import mathutils
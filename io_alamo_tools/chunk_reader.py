@@ -0,0 +1,81 @@
+import mmap
+import struct
+
+#chunk header: 4 byte id followed by 4 byte size
+chunk_header = struct.Struct("<II")
+
+class Chunk():
+    def __init__(self, id, offset, size):
+        self.id = id
+        self.offset = offset    #position of the chunk data, directly after the header
+        self.size = size
+        self.children = []
+
+class ChunkReader():
+    #memory maps a chunk based file and indexes all chunk headers with a single scan
+    #offers a file like interface so mini chunks can still be read sequentially
+
+    def __init__(self, path):
+        self.name = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.map)
+        self.size = len(self.map)
+        self.position = 0
+        self.chunks = self.scan(0, self.size)
+
+    def scan(self, start, end):
+        chunks = []
+        offset = start
+        while offset + chunk_header.size <= end:
+            id, size = chunk_header.unpack_from(self.map, offset)
+            #the high bit is used to tell if chunk holds data or chunks
+            has_children = size >= 2147483648
+            if has_children:
+                size -= 2147483648
+            chunk = Chunk(id, offset + chunk_header.size, size)
+            if chunk.offset + size > end:
+                print('Warning: chunk ' + hex(id) + ' exceeds its parent, ignoring the rest of the chunk')
+                break
+            if has_children:
+                chunk.children = self.scan(chunk.offset, chunk.offset + size)
+            chunks.append(chunk)
+            offset = chunk.offset + size
+        return chunks
+
+    def view(self, offset, size):
+        #zero-copy slice of the file
+        return self.buffer[offset:offset + size]
+
+    def read_view(self, size):
+        data = self.view(self.position, size)
+        self.position += len(data)
+        return data
+
+    def read(self, size):
+        data = self.map[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.buffer.release()
+        try:
+            self.map.close()
+        except BufferError:
+            #views of the file are still referenced, e.g. by the traceback of a failed read
+            #dropping the map lets it be unmapped once they are collected
+            pass
+        self.buffer = None
+        self.map = None
+        self.file.close()
@@ -22,53 +22,281 @@ from bpy_extras.io_utils import ExportHelper, ImportHelper
 import sys
 import os
 import bmesh
+import numpy as np
+import hashlib
+import json
 
 def chunk_size(size):
             #high bit is used to determine if a chunk holds chunks or data
             #add 2147483648 instead of binary operation
             return size+2147483648
 
-def calculateTranslationScale(bone, translationOffset, armature, translationList):
-    scene = bpy.context.scene  # current scene
-    # check for every bone if it has translation data
-    if (bone.name in translationList):
-        scene.frame_set(0)
-        pose = armature.pose.bones[bone.name]  # get the pose bone
-        # search for maximum translation
-        maxX = 0
-        maxY = 0
-        maxZ = 0
-
-        action = utils.getCurrentAction()
-        animLength = action.AnimationEndFrame
-
-        while (scene.frame_current <= animLength):  # iterate over every frame
-            if pose.parent != None:
-                translation_relative = (pose.parent.matrix.inverted() @ pose.matrix).decompose()[0]
-            else:
-                translation_relative = pose.matrix.decompose()[0]
-
-            if (abs(translation_relative[0] - translationOffset[0]) > maxX):
-                maxX = abs(translation_relative[0] - translationOffset[0])
-            if (abs(translation_relative[1] - translationOffset[1]) > maxY):
-                maxY = abs(translation_relative[1] - translationOffset[1])
-            if (abs(translation_relative[2] - translationOffset[2]) > maxZ):
-                maxZ = abs(translation_relative[2] - translationOffset[2])
-            scene.frame_set(scene.frame_current + 1)
+#translation tracks that move less than this, relative to their distance from the parent, are treated as static
+static_translation_tolerance = 1e-5
+
+class AnimationTracks():
+    #animated channels of every bone, parsed once from the F-Curves of the action
+    def __init__(self, armature, action):
+        self.curves = {}    #bone name -> property name -> array index -> F-Curve
+        for curve in action.fcurves:
+            # by spliting the data path we know which bone and property the keyframes belong to
+            path = curve.data_path.split('"')
+            if len(path) != 3 or path[0] != 'pose.bones[':
+                continue
+            properties = self.curves.setdefault(path[1], {})
+            properties.setdefault(path[2][2:], {})[curve.array_index] = curve
+
+        # bones with location/rotation keyframes, in the order of their blocks in the data chunks
+        self.translationList = []
+        self.rotationList = []
+        for pose in armature.pose.bones:
+            properties = self.curves.get(pose.name, {})
+            if 'location' in properties:
+                self.translationList.append(pose.name)
+            if any(('].' + property) in settings.rotation_curve_name for property in properties):
+                self.rotationList.append(pose.name)
+
+        self.update_indices()
+        # start at 1 because we ignore root bone
+        self.boneIndex = {bone.name: index + 1 for index, bone in enumerate(armature.data.bones)}
+
+    def update_indices(self):
+        # indices count values, not bones
+        self.translationIndex = {name: 3 * index for index, name in enumerate(self.translationList)}
+        self.rotationIndex = {name: 4 * index for index, name in enumerate(self.rotationList)}
+
+    def prune_static_tracks(self, samples):
+        # keyed tracks that don't change are stored as default rotation or translation offset instead of per frame
+        # returns the number of removed rotation and translation tracks
+        staticRotations = []
+        for name in self.rotationList:
+            rotations = samples.rotations[:, samples.boneIndex[name]]
+            # q and -q are the same rotation
+            rotations = rotations * np.where(rotations[:, :1] < 0, -1, 1)
+            quantized = np.round(rotations * 32767)
+            if (quantized == quantized[0]).all():
+                staticRotations.append(name)
+
+        staticTranslations = []
+        for name in self.translationList:
+            locations = samples.locations[:, samples.boneIndex[name]]
+            # the values are stored relative to the offset, so the threshold is relative to their size
+            threshold = static_translation_tolerance * max(1.0, np.abs(locations).max())
+            if (locations.max(axis=0) - locations.min(axis=0)).max() <= threshold:
+                staticTranslations.append(name)
+
+        self.rotationList = [name for name in self.rotationList if name not in staticRotations]
+        self.translationList = [name for name in self.translationList if name not in staticTranslations]
+        self.update_indices()
+        return len(staticRotations), len(staticTranslations)
+
+    def curve(self, boneName, property, index=0):
+        return self.curves.get(boneName, {}).get(property, {}).get(index)
+
+class AnimationSamples():
+    #parent relative transforms of every bone at every frame of the animation
+    def __init__(self, armature, frameCount):
+        self.boneNames = [pose.name for pose in armature.pose.bones]
+        self.boneIndex = {name: index for index, name in enumerate(self.boneNames)}
+        self.locations = np.empty((frameCount, len(self.boneNames), 3))
+        self.rotations = np.empty((frameCount, len(self.boneNames), 4))    #w, x, y, z
+
+def isolate_armature(armature, hidden):
+    #hides every object the pose of the armature doesn't depend on, so changing the frame only evaluates the skeleton
+    #hidden objects are added to hidden as they are hidden, they have to be shown again with restore_isolation()
+    keep = set()
+
+    def keep_object(object):
+        while object != None and object not in keep:
+            keep.add(object)
+            object = object.parent
+
+    keep_object(armature)
+    for pose in armature.pose.bones:
+        for constraint in pose.constraints:
+            keep_object(getattr(constraint, 'target', None))
+            for target in getattr(constraint, 'targets', []):
+                keep_object(target.target)
+            keep_object(getattr(constraint, 'pole_target', None))
+    if armature.animation_data != None:
+        for driver in armature.animation_data.drivers:
+            for variable in driver.driver.variables:
+                for target in variable.targets:
+                    if isinstance(target.id, bpy.types.Object):
+                        keep_object(target.id)
+
+    for object in bpy.context.scene.objects:
+        #linked objects can't be edited, they are still evaluated
+        if object in keep or object.hide_viewport or object.library != None:
+            continue
+        object.hide_viewport = True
+        hidden.append(object)
+
+def restore_isolation(hidden):
+    for object in hidden:
+        object.hide_viewport = False
+
+def sample_animation(armature, isolate=False):
+    #steps through the animation once, every other value of the file is derived from these samples
+    scene = bpy.context.scene
+    action = utils.getCurrentAction()
+    animLength = action.AnimationEndFrame
+
+    samples = AnimationSamples(armature, animLength + 1)
+    parents = [-1 if pose.parent == None else samples.boneIndex[pose.parent.name] for pose in armature.pose.bones]
+
+    #armature space matrices of all bones, blender stores matrices column major
+    matrices = np.empty((animLength + 1, len(samples.boneNames) * 16), dtype=np.float32)
+    hidden = []
+    try:
+        if isolate:
+            isolate_armature(armature, hidden)
+        for frame in range(animLength + 1):
+            scene.frame_set(frame)
+            armature.pose.bones.foreach_get('matrix', matrices[frame])
+    finally:
+        restore_isolation(hidden)
         scene.frame_set(0)
+    matrices = matrices.reshape(animLength + 1, -1, 4, 4).transpose(0, 1, 3, 2).astype(np.float64)
+
+    samples.locations[:], samples.rotations[:] = relative_transforms(matrices, parents)
+    return samples
+
+def relative_transforms(matrices, parents):
+    #matrices is a (frames, bones, 4, 4) array of armature space matrices, parents holds the parent index of every bone or -1
+    #returns the locations and rotations of every bone relative to its parent
+    parents = np.array(parents)
+    relative = matrices.copy()
+    children = np.flatnonzero(parents != -1)
+    if len(children) > 0:
+        relative[:, children] = np.linalg.inv(matrices[:, parents[children]]) @ matrices[:, children]
+
+    locations = relative[..., :3, 3]
+    #remove scale before extracting the rotation, like decompose()
+    rotation = relative[..., :3, :3] / np.linalg.norm(relative[..., :3, :3], axis=-2)[..., None, :]
+    return locations, matrix_to_quaternion(rotation)
+
+def matrix_to_quaternion(m):
+    #converts (..., 3, 3) rotation matrices to w, x, y, z quaternions
+    #the largest component is computed from the diagonal, the others from it to stay numerically stable
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    diagonal = np.stack((1 + m00 + m11 + m22, 1 + m00 - m11 - m22, 1 - m00 + m11 - m22, 1 - m00 - m11 + m22), axis=-1)
+    case = diagonal.argmax(axis=-1)
+    s = np.sqrt(np.maximum(np.take_along_axis(diagonal, case[..., None], axis=-1)[..., 0], 1e-12)) * 2
+
+    candidates = np.stack((
+        np.stack((s / 4, (m21 - m12) / s, (m02 - m20) / s, (m10 - m01) / s), axis=-1),
+        np.stack(((m21 - m12) / s, s / 4, (m01 + m10) / s, (m02 + m20) / s), axis=-1),
+        np.stack(((m02 - m20) / s, (m01 + m10) / s, s / 4, (m12 + m21) / s), axis=-1),
+        np.stack(((m10 - m01) / s, (m02 + m20) / s, (m12 + m21) / s, s / 4), axis=-1),
+    ), axis=-2)
+    q = np.take_along_axis(candidates, case[..., None, None], axis=-2)[..., 0, :]
+
+    #keep w positive so equal rotations are stored the same way
+    q[q[..., 0] < 0] *= -1
+    return q / np.linalg.norm(q, axis=-1)[..., None]
+
+def euler_to_quaternion(angles, order):
+    #angles is a (..., 3) array of x, y, z angles, order is the blender rotation mode, e.g. 'XYZ'
+    result = None
+    for axis in order:
+        index = 'XYZ'.index(axis)
+        half = angles[..., index] / 2
+        q = np.zeros(angles.shape[:-1] + (4,))
+        q[..., 0] = np.cos(half)
+        q[..., index + 1] = np.sin(half)
+        #the first axis of the order is applied first
+        result = q if result is None else utils.quaternion_multiply(q, result)
+    return result
+
+def evaluate_fcurve(curve, frames):
+    #linear curves are interpolated directly, everything else is evaluated by blender
+    count = len(curve.keyframe_points)
+    if count > 0 and len(curve.modifiers) == 0 and curve.extrapolation == 'CONSTANT':
+        interpolation = np.empty(count, dtype=np.int32)
+        curve.keyframe_points.foreach_get('interpolation', interpolation)
+        if count == 1 or (interpolation[:-1] == utils.keyframe_interpolation['LINEAR']).all():
+            co = np.empty(count * 2, dtype=np.float32)
+            curve.keyframe_points.foreach_get('co', co)
+            co = co.reshape(-1, 2)
+            return np.interp(frames, co[:, 0], co[:, 1])
+    return np.array([curve.evaluate(frame) for frame in frames])
+
+def can_evaluate_fcurves(armature, tracks):
+    #the pose can be computed from the action alone if nothing but the action moves the bones
+    animation_data = armature.animation_data
+    if len(animation_data.drivers) > 0 or len(animation_data.nla_tracks) > 0:
+        return False
+    for pose in armature.pose.bones:
+        if len(pose.constraints) > 0:
+            return False
+        if pose.rotation_mode == 'AXIS_ANGLE' or tuple(pose.scale) != (1, 1, 1):
+            return False
+        bone = pose.bone
+        if not bone.use_inherit_rotation or bone.inherit_scale != 'FULL' or not bone.use_local_location:
+            return False
+    for properties in tracks.curves.values():
+        if 'scale' in properties:
+            return False
+    return True
+
+def evaluate_animation(armature, tracks):
+    #computes the same samples as sample_animation without evaluating the scene
+    #the parent relative transform of a bone is parent_rest^-1 @ rest @ matrix_basis
+    action = utils.getCurrentAction()
+    animLength = action.AnimationEndFrame
+    frames = np.arange(animLength + 1, dtype=np.float64)
+
+    def evaluate_channel(name, property, index, current):
+        #channels without fcurves or with muted fcurves keep their current value
+        curve = tracks.curve(name, property, index)
+        if curve == None or curve.mute or (curve.group != None and curve.group.mute):
+            return current
+        return evaluate_fcurve(curve, frames)
+
+    samples = AnimationSamples(armature, animLength + 1)
+    for index, name in enumerate(samples.boneNames):
+        pose = armature.pose.bones[name]
+
+        location = np.zeros((len(frames), 3))
+        #blender ignores the location of connected bones
+        if not pose.bone.use_connect:
+            for i in range(3):
+                location[:, i] = evaluate_channel(name, 'location', i, pose.location[i])
+
+        if pose.rotation_mode == 'QUATERNION':
+            rotation = np.empty((len(frames), 4))
+            for i in range(4):
+                rotation[:, i] = evaluate_channel(name, 'rotation_quaternion', i, pose.rotation_quaternion[i])
+            rotation /= np.linalg.norm(rotation, axis=1)[:, None]
+        else:
+            euler = np.empty((len(frames), 3))
+            for i in range(3):
+                euler[:, i] = evaluate_channel(name, 'rotation_euler', i, pose.rotation_euler[i])
+            rotation = euler_to_quaternion(euler, pose.rotation_mode)
 
-        if (maxX == 0):
-            maxX = 1
-        if (maxY == 0):
-            maxY = 1
-        if (maxZ == 0):
-            maxZ = 1
+        bone = pose.bone
+        rest = bone.matrix_local
+        if bone.parent != None:
+            rest = bone.parent.matrix_local.inverted() @ rest
+        rest_rotation, rest_quaternion, rest_translation = utils.decompose_rigid(rest)
 
-        scaleX = maxX / 65535.0
-        scaleY = maxY / 65535.0
-        scaleZ = maxZ / 65535.0
+        samples.locations[:, index] = location @ rest_rotation.T + rest_translation
+        samples.rotations[:, index] = utils.quaternion_multiply(rest_quaternion, rotation)
 
-        translationScale = (scaleX, scaleY, scaleZ)
+    return samples
+
+def calculateTranslationScale(bone, translationOffset, samples, tracks):
+    # check for every bone if it has translation data
+    if (bone.name in tracks.translationIndex):
+        # search for maximum translation
+        locations = samples.locations[:, samples.boneIndex[bone.name]]
+        translationScale = np.abs(locations - np.array(translationOffset)).max(axis=0)
+        translationScale[translationScale == 0] = 1
+        translationScale = translationScale / 65535.0
 
         global translationScaleDict
         translationScaleDict[bone.name] = translationScale
@@ -77,106 +305,49 @@ def calculateTranslationScale(bone, translationOffset, armature, translationList
     else:
         return mathutils.Vector((0, 0, 0))
 
-def calculateTranslationOffset(bone, armature, translationList):
-    scene = bpy.context.scene  # current scene
-    # check for every bone if it has translation data
-    pose = armature.pose.bones[bone.name]
-
+def calculateTranslationOffset(bone, samples, tracks):
     # if the bone has no animated translation data the offset is the relative translation data at an arbitrary frame, first frame is used
     # if the bone has animated translation data, the offset is the minimum of every translation
     # this is necessary because the translation data is stored as unsigned shorts, so every relative motion has to be positive
-
-    if (bone.name in translationList):
-        scene.frame_set(0)
-        minX = 65535
-        minY = 65535
-        minZ = 65535
-
-        action = utils.getCurrentAction()
-        animLength = action.AnimationEndFrame
-
-        while (scene.frame_current <= animLength):  # iterate over every frame
-            if pose.parent != None:
-                translation_relative = (pose.parent.matrix.inverted() @ pose.matrix).decompose()[0]
-            else:
-                translation_relative = pose.matrix.decompose()[0]
-            if (translation_relative[0] < minX):
-                minX = translation_relative[0]
-            if (translation_relative[1] < minY):
-                minY = translation_relative[1]
-            if (translation_relative[2] < minZ):
-                minZ = translation_relative[2]
-            scene.frame_set(scene.frame_current + 1)
-        scene.frame_set(0)
-
-        return mathutils.Vector((minX, minY, minZ))
+    locations = samples.locations[:, samples.boneIndex[bone.name]]
+    if (bone.name in tracks.translationIndex):
+        return mathutils.Vector(locations.min(axis=0))
     else:
-        if pose.parent != None:
-            return (pose.parent.matrix.inverted() @ pose.matrix).decompose()[0]
-        else:
-            return pose.matrix.decompose()[0]
+        return mathutils.Vector(locations[0])
 
-def create_translation_data(translationList, armature):
-    scene = bpy.context.scene
-    scene.frame_set(0)
-    chunk = b''
-
-    action = utils.getCurrentAction()
-    animLength = action.AnimationEndFrame
-
-    while (scene.frame_current <= animLength):
-        for name in translationList:
-            bone = armature.data.bones[name]
-            pose = armature.pose.bones[bone.name]
-            if pose.parent != None:
-                translation_relative = (pose.parent.matrix.inverted() @ pose.matrix).decompose()[0]
-            else:
-                translation_relative = pose.matrix.decompose()[0]
+def create_translation_data(tracks, samples):
+    translationList = tracks.translationList
+    if len(translationList) == 0:
+        return b''
 
-            chunk += struct.pack("<H", int((translation_relative[0] - translationOffsetDict[pose.name][0]) / translationScaleDict[bone.name][0]))
-            chunk += struct.pack("<H", int((translation_relative[1] - translationOffsetDict[pose.name][1]) / translationScaleDict[bone.name][1]))
-            chunk += struct.pack("<H", int((translation_relative[2] - translationOffsetDict[pose.name][2]) / translationScaleDict[bone.name][2]))
+    indices = [samples.boneIndex[name] for name in translationList]
+    offsets = np.array([translationOffsetDict[name] for name in translationList])
+    scales = np.array([translationScaleDict[name] for name in translationList])
 
-        scene.frame_set(scene.frame_current + 1)
-    scene.frame_set(0)
+    #one block of x, y, z per frame, relative to the offset
+    quantized = (samples.locations[:, indices] - offsets) / scales
+    chunk = np.clip(quantized, 0, 65535).astype('<u2').tobytes()
 
     chunk_header = (b'\x0a\x10\x00\00')  # chunk header
     chunk_header += struct.pack("<I", len(chunk))  # chunk size
-    if len(chunk) == 0:
-        return b''
     return chunk_header + chunk
 
-def create_rotation_data(rotationList, armature):
-    chunk = (b'')
-    scene = bpy.context.scene
-    scene.frame_set(0)
+def create_rotation_data(tracks, samples):
+    rotationList = tracks.rotationList
+    if len(rotationList) == 0:
+        return b''
 
-    action = utils.getCurrentAction()
-    animLength = action.AnimationEndFrame
+    indices = [samples.boneIndex[name] for name in rotationList]
 
-    while (scene.frame_current <= animLength):
-        for name in rotationList:
-            bone = armature.data.bones[name]
-
-            pose = armature.pose.bones[bone.name]
-            if pose.parent == None:
-                rotation_relative = pose.matrix.decompose()[1]
-            else:
-                rotation_relative = (pose.parent.matrix.inverted() @ pose.matrix).decompose()[1]
-            chunk += struct.pack("<h", int(round(rotation_relative[1] * 32767)))
-            chunk += struct.pack("<h", int(round(rotation_relative[2] * 32767)))
-            chunk += struct.pack("<h", int(round(rotation_relative[3] * 32767)))
-            chunk += struct.pack("<h", int(round(rotation_relative[0] * 32767)))
-        scene.frame_set(scene.frame_current + 1)
-    scene.frame_set(0)
+    #one block per frame, stored in x, y, z, w order
+    rotations = samples.rotations[:, indices][:, :, [1, 2, 3, 0]]
+    chunk = np.round(rotations * 32767).astype('<i2').tobytes()
 
     chunk_header = (b"\x09\x10\x00\00")  # chunk header
     chunk_header += struct.pack("<I", len(chunk))  # chunk size
-    if len(chunk) == 0:
-        return b''
     return chunk_header + chunk
 
-def create_animation():
+def create_animation(evaluateFCurves=True, isolateArmature=True):
 
     chunk = b''
     # get armature name
@@ -185,40 +356,42 @@ def create_animation():
         print("Warning: No armature found!")
         return b''
 
-    chunk += create_anim_info_chunk(armature)
+    if armature.animation_data == None or armature.animation_data.action == None:
+        raise RuntimeError('Warning: no animation data found')
 
-    rotationList = []
-    translationList = []
+    action = armature.animation_data.action
+    tracks = AnimationTracks(armature, action)
 
-    if armature.animation_data == None:
-        return b''
+    # the pose of every bone is sampled once, all chunks are created from the samples
+    samples = None
+    if evaluateFCurves and can_evaluate_fcurves(armature, tracks):
+        samples = evaluate_animation(armature, tracks)
+    if samples == None:
+        samples = sample_animation(armature, isolateArmature)
+
+    staticRotations, staticTranslations = tracks.prune_static_tracks(samples)
+    if staticRotations + staticTranslations > 0:
+        # every frame stores 4 shorts per rotation and 3 per translation
+        savedBytes = len(samples.rotations) * (staticRotations * 8 + staticTranslations * 6)
+        print("Action '" + action.name + "': removed " + str(staticRotations) + " static rotation and " + str(staticTranslations)
+              + " static translation tracks, saved " + str(savedBytes) + " bytes")
+
+    chunk += create_anim_info_chunk(armature, tracks)
 
-    # iterate over every pose bone
-    for pose in armature.pose.bones:
-        # iterate over every fcurves data (keyframes)
-        for curve in armature.animation_data.action.fcurves:
-            # by spliting and comparing the data path we know which bone has rotation/location keyframes
-            if curve.data_path.split('"')[1] == pose.name and curve.data_path.split('"')[2] == '].location':
-                if (not (pose.name in translationList)): translationList.append(pose.name)  # if list doesnt contaion bone name add it
-            if curve.data_path.split('"')[1] == pose.name and curve.data_path.split('"')[2] in settings.rotation_curve_name:
-                if (not (pose.name in rotationList)):
-                    rotationList.append(pose.name)  # if list doesnt contaion bone name add it
-
-    bpy.context.scene.frame_set(0)  # set scene to first frame, needed for default rotation/translation
     # add the bone data chunks for every bone
     for bone in armature.data.bones:
         if (bone.name != "Root"):
-            chunk += create_bone_data(bone, translationList, rotationList, armature)
+            chunk += create_bone_data(bone, tracks, samples)
 
-    chunk += create_translation_data(translationList, armature)  # add translation data chunk
-    chunk += create_rotation_data(rotationList, armature)  # add rotation data chunk
+    chunk += create_translation_data(tracks, samples)  # add translation data chunk
+    chunk += create_rotation_data(tracks, samples)  # add rotation data chunk
 
     header = (b"\x00\x10\x00\00")
     header += struct.pack("<I", chunk_size(len(chunk))) # chunk size
 
     return header + chunk
 
-def create_anim_info_chunk(armature):
+def create_anim_info_chunk(armature, tracks):
 
     action = utils.getCurrentAction()
     animLength = action.AnimationEndFrame
@@ -233,29 +406,14 @@ def create_anim_info_chunk(armature):
     chunk += struct.pack("<I", len(
         armature.data.bones))  # add number of bones
 
-    locationTracks = 0  # number of bones with location keyframes
-    rotationTracks = 0  # number of bones with rotation keyframes
-    # calculate location and rotation block sizes
-    # iterate over every pose bone
-    for pose in armature.pose.bones:  # iterate over every bone
-        if armature.animation_data == None:
-            raise RuntimeError('Warning: no animation data found')
-        # iterate over every fcurves data (keyframes)
-        for curve in armature.animation_data.action.fcurves:
-            # by spliting and comparing the data path we know which bone has rotation/location keyframes
-            if curve.data_path.split('"')[1] == pose.name and curve.data_path.split('"')[2] == '].location':
-                locationTracks += 1
-            if curve.data_path.split('"')[1] == pose.name and curve.data_path.split('"')[
-                2] == '].rotation_quaternion':
-                rotationTracks += 1
-
+    # block sizes count values, a rotation has 4 and a translation 3
     # add rotationBlockSize
     chunk += b'\x0b\x04'  # mini chunk name and length
-    chunk += struct.pack("<I", rotationTracks)
+    chunk += struct.pack("<I", 4 * len(tracks.rotationList))
 
     # add translationBlockSize
     chunk += b'\x0c\x04'  # mini chunk name and length
-    chunk += struct.pack("<I", locationTracks)
+    chunk += struct.pack("<I", 3 * len(tracks.translationList))
 
     # addScaleBlockSize, scale not supported set to 0
     chunk += b'\x0d\x04'  # mini chunk name and length
@@ -266,36 +424,22 @@ def create_anim_info_chunk(armature):
 
     return chunkHeader + chunk
 
-def create_bone_data(bone, translationList, rotationList, armature):
-    chunk = create_bone_animation_info_chunk(bone, translationList, rotationList, armature)
+def create_bone_data(bone, tracks, samples):
+    chunk = create_bone_animation_info_chunk(bone, tracks, samples)
     header = (b"\x02\x10\x00\00")
     header += struct.pack("<I", chunk_size(len(chunk))) # add length
     return header + chunk
     # add support for step key track
 
-def create_bone_animation_info_chunk(bone, translationList, rotationList, armature):
-
-    # for animation data we have to go into pose mode
-    utils.setModeToObject()
-
-    # select the skeleton
-    armature.select_set(True)
-    bpy.context.view_layer.objects.active = armature
-    bpy.ops.object.mode_set(mode='POSE')  # enter pose mode
-    pose = armature.pose.bones[bone.name]
+def create_bone_animation_info_chunk(bone, tracks, samples):
 
-    scene = bpy.context.scene
-    scene.frame_set(0)
-    translationOffset = calculateTranslationOffset(bone, armature, translationList)
+    translationOffset = calculateTranslationOffset(bone, samples, tracks)
     global translationOffsetDict
     translationOffsetDict[bone.name] = translationOffset
-    translationScale = calculateTranslationScale(bone, translationOffset, armature, translationList)
+    translationScale = calculateTranslationScale(bone, translationOffset, samples, tracks)
 
     # default rotation is rotation of first frame
-    if pose.parent != None:
-        default_rotation = (pose.parent.matrix.inverted() @ pose.matrix).decompose()[1]
-    else:
-        default_rotation = pose.matrix.decompose()[1]
+    default_rotation = samples.rotations[0, samples.boneIndex[bone.name]]
 
     chunk = b'\x04'  # mini chunk name
     name = utils.clean_name(bone.name)
@@ -304,14 +448,7 @@ def create_bone_animation_info_chunk(bone, translationList, rotationList, armatu
 
     chunk += b'\x05\x04'  # mini chunk name and length
 
-    # get the index of the current bone
-    counter = 1 #start at because we ignore root bone
-    for b in armature.data.bones:
-        if (bone.name == b.name):
-            index = counter
-            break
-        counter += 1
-    chunk += struct.pack("<i", index)  # index of bone
+    chunk += struct.pack("<i", tracks.boneIndex[bone.name])  # index of bone
 
     chunk += b'\x0a\x04'  # mini chunk name and length
     chunk += b'\x00\x00\00\00'  # unknown chunk
@@ -342,10 +479,7 @@ def create_bone_animation_info_chunk(bone, translationList, rotationList, armatu
 
     # add translation index
     chunk += b'\x0e\x02'  # mini chunk name and length
-    if (bone.name in translationList):
-        translationIndex = translationList.index(bone.name) * 3  # if bone is in location list use index in list as index
-    else:
-        translationIndex = -1  # if bone is not in location list use -1
+    translationIndex = tracks.translationIndex.get(bone.name, -1)  # if bone is not in location list use -1
     chunk += struct.pack("<h", translationIndex)
 
     # add scale index
@@ -354,11 +488,7 @@ def create_bone_animation_info_chunk(bone, translationList, rotationList, armatu
 
     # add rotation index
     chunk += b'\x10\x02'  # mini chunk name and length
-    if (bone.name in rotationList):
-        rotationIndex = 4 * rotationList.index(
-            bone.name)  # if bone is in rotation list use index in list as index
-    else:
-        rotationIndex = -1  # if bone is not in rotation list use -1
+    rotationIndex = tracks.rotationIndex.get(bone.name, -1)  # if bone is not in rotation list use -1
 
     chunk += struct.pack("<h", rotationIndex)
 
@@ -375,54 +505,122 @@ def create_bone_animation_info_chunk(bone, translationList, rotationList, armatu
 
     chunk = header + chunk
 
-    visibility_chunk = create_visibility_chunk(armature, bone)
+    visibility_chunk = create_visibility_chunk(tracks, bone)
 
     return chunk + visibility_chunk
 
-def create_visibility_chunk(armature, bone):
-    dataExists = False
-    for curve in armature.animation_data.action.fcurves:
-        # by spliting and comparing the data path we know which bone has rotation/location keyframes
-        if curve.data_path.split('"')[1] == bone.name and curve.data_path.split('"')[2] == '].proxyIsHiddenAnimation':
-            dataExists = True
-            break
-
-    if not dataExists:
+def create_visibility_chunk(tracks, bone):
+    curve = tracks.curve(bone.name, 'proxyIsHiddenAnimation')
+    if curve == None or len(curve.keyframe_points) == 0:
         return b''
 
-    scene = bpy.context.scene
-    binary = ''
-
-    pose = armature.pose.bones[bone.name]
-
     action = utils.getCurrentAction()
     animLength = action.AnimationEndFrame
 
-    scene.frame_set(0)
-    while scene.frame_current <= animLength:
-        if pose.proxyIsHiddenAnimation == True:
-            binary += '0'
-        else:
-            binary += '1'
-        scene.frame_set(scene.frame_current + 1)
-    scene.frame_set(0)
-
-    while len(binary)%8 != 0:
-        binary += '0'
+    #visibility is stepped, every frame takes the value of the last keyframe before it
+    keyframes = np.empty(len(curve.keyframe_points) * 2, dtype=np.float32)
+    curve.keyframe_points.foreach_get('co', keyframes)
+    keyframes = keyframes.reshape(-1, 2)
+    frames = np.arange(animLength + 1)
+    index = np.searchsorted(keyframes[:, 0], frames, side='right') - 1
+    hidden = keyframes[np.maximum(index, 0), 1] >= 0.5
 
-    chunk = b''
+    #one bit per frame, set if the bone is visible, least significant bit first
+    chunk = np.packbits(~hidden, bitorder='little').tobytes()
 
-    while len(binary) > 1:
-        binaryReverse = binary[0:8][::-1] #file is little endian, reverse byte
-        int_value = int(binaryReverse, 2)
-        chunk += struct.pack('<B', int_value)
-        binary = binary[8:]
-    print()
     chunkHeader = b'\x07\x10\x00\00'
     chunkHeader += struct.pack('<I', len(chunk))
     return chunkHeader + chunk
 
+def action_targets_armature(action, armature):
+    #an action belongs to the armature if it animates its bones and no bones the armature doesn't have
+    targetsBones = False
+    for curve in action.fcurves:
+        path = curve.data_path.split('"')
+        if len(path) != 3 or path[0] != 'pose.bones[':
+            continue
+        if path[1] not in armature.pose.bones:
+            return False
+        targetsBones = True
+    return targetsBones
+
+def hash_settings(hash, data):
+    #adds all settings of a blender struct, e.g. an F-Curve modifier, to the hash
+    for property in data.bl_rna.properties:
+        if property.identifier == 'rna_type' or property.type == 'POINTER':
+            continue
+        value = getattr(data, property.identifier)
+        if property.type == 'COLLECTION':
+            for item in value:
+                hash_settings(hash, item)
+            continue
+        if getattr(property, 'is_array', False):
+            value = tuple(value)
+        hash.update(bytes(property.identifier + '=' + repr(value) + '\x00', 'utf-8'))
+
+def animation_hash(action, armature):
+    #hash of everything the exported file depends on: keyframes, F-Curve modifiers, rest pose,
+    #the current pose of channels without keyframes, animation length and frame rate
+    hash = hashlib.sha1()
+    hash.update(struct.pack("<If", action.AnimationEndFrame, bpy.context.scene.render.fps))
+
+    for bone in armature.data.bones:
+        parent = bone.parent.name if bone.parent != None else ''
+        hash.update(bytes(bone.name + '\x00' + parent + '\x00', 'utf-8'))
+    rest = np.empty(len(armature.data.bones) * 16, dtype=np.float32)
+    armature.data.bones.foreach_get('matrix_local', rest)
+    hash.update(rest.tobytes())
+
+    for curve in sorted(action.fcurves, key=lambda curve: (curve.data_path, curve.array_index)):
+        hash.update(bytes(curve.data_path + '\x00' + curve.extrapolation + '\x00', 'utf-8'))
+        hash.update(struct.pack("<II", curve.array_index, len(curve.modifiers)))
+        keyframes = curve.keyframe_points
+        for property in ('co', 'handle_left', 'handle_right'):
+            values = np.empty(len(keyframes) * 2, dtype=np.float32)
+            keyframes.foreach_get(property, values)
+            hash.update(values.tobytes())
+        interpolation = np.empty(len(keyframes), dtype=np.int32)
+        keyframes.foreach_get('interpolation', interpolation)
+        hash.update(interpolation.tobytes())
+        for modifier in curve.modifiers:
+            hash.update(bytes(modifier.type + '\x00', 'utf-8'))
+            hash_settings(hash, modifier)
+
+    #channels without keyframes keep their current value, keyed channels depend on the current frame and are skipped
+    tracks = AnimationTracks(armature, action)
+    for pose in armature.pose.bones:
+        hash.update(bytes(pose.name + '\x00' + pose.rotation_mode + '\x00', 'utf-8'))
+        for property in ('location', 'rotation_quaternion', 'rotation_euler', 'scale'):
+            values = getattr(pose, property)
+            for index in range(len(values)):
+                if tracks.curve(pose.name, property, index) == None:
+                    hash.update(struct.pack("<f", values[index]))
+
+    return hash.hexdigest()
+
+#manifest of exported animations, changing the version invalidates all entries
+manifest_version = 1
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != manifest_version:
+        return {}
+    return manifest.get('actions', {})
+
+def save_manifest(path, actions):
+    with open(path, 'w') as file:
+        json.dump({'version': manifest_version, 'actions': actions}, file, indent=1, sort_keys=True)
+
 class AnimationExporter():
+    def __init__(self, evaluateFCurves=True, isolateArmature=True):
+        #compute the pose from the action instead of evaluating the scene, if the rig allows it
+        self.evaluateFCurves = evaluateFCurves
+        #only evaluate the armature and the objects it depends on while sampling
+        self.isolateArmature = isolateArmature
 
     def exportAnimation(self, path):
         file = open(path, 'wb')  # open file in read binary mode
@@ -431,7 +629,7 @@ class AnimationExporter():
         translationOffsetDict = {}
         global translationScaleDict
         translationScaleDict = {}
-        file.write(create_animation())
+        file.write(create_animation(self.evaluateFCurves, self.isolateArmature))
         file.close()
         file = None
 
@@ -451,12 +649,29 @@ class ALA_Exporter(bpy.types.Operator):
     filepath : StringProperty(name="File Path", description="Filepath used for exporting the ALO file", maxlen=1024,
                               default="")
 
+    evaluateFCurves : BoolProperty(
+            name="Evaluate F-Curves Directly",
+            description="Compute the pose from the action instead of evaluating the scene on every frame. Rigs with constraints or drivers are always evaluated",
+            default=True,
+            )
+
+    isolateArmature : BoolProperty(
+            name="Only Evaluate Armature",
+            description="Hide all objects the skeleton doesn't depend on while sampling the animation, so meshes aren't evaluated on every frame",
+            default=True,
+            )
+
+    def draw(self, context):
+        layout = self.layout
+
+        layout.prop(self, "evaluateFCurves")
+        layout.prop(self, "isolateArmature")
 
     def execute(self, context):
 
         path = self.properties.filepath
 
-        exporter = AnimationExporter()
+        exporter = AnimationExporter(self.evaluateFCurves, self.isolateArmature)
         exporter.exportAnimation(path)
 
         return {'FINISHED'}  # this lets blender know the operator finished successfully.
@@ -23,6 +23,7 @@ import sys
 import os
 import bmesh
 import copy
+import numpy as np
 
 class ALO_Exporter(bpy.types.Operator):
 
@@ -52,10 +53,37 @@ class ALO_Exporter(bpy.types.Operator):
             default=True,
             )
 
+    evaluateFCurves : BoolProperty(
+            name="Evaluate F-Curves Directly",
+            description="Compute animation poses from the action instead of evaluating the scene on every frame. Rigs with constraints or drivers are always evaluated",
+            default=True,
+            )
+
+    skipUnchangedAnimations : BoolProperty(
+            name="Skip Unchanged Animations",
+            description="Only export actions that changed since the last export or whose .ALA file is missing",
+            default=True,
+            )
+
+    isolateArmature : BoolProperty(
+            name="Only Evaluate Armature",
+            description="Hide all objects the skeleton doesn't depend on while sampling animations, so meshes aren't evaluated on every frame",
+            default=True,
+            )
+
     def draw(self, context):
         layout = self.layout
 
         layout.prop(self, "exportAnimations")
+        row = layout.row()
+        row.enabled = self.exportAnimations
+        row.prop(self, "evaluateFCurves")
+        row = layout.row()
+        row.enabled = self.exportAnimations
+        row.prop(self, "isolateArmature")
+        row = layout.row()
+        row.enabled = self.exportAnimations
+        row.prop(self, "skipUnchangedAnimations")
         layout.prop(self, "exportHiddenObjects")
 
     def execute(self, context):  # execute() is called by blender when running the operator.
@@ -370,12 +398,10 @@ class ALO_Exporter(bpy.types.Operator):
                 file.write(utils.pack_int(chunk_size(jumpEndPoint - jumpPointSize - 4)))
                 file.seek(jumpEndPoint, 0)
 
-        def create_index_buffer(face_data):
+        def create_index_buffer(indices):
             index_buffer_header = b"\x04\x00\x01\00"  # add chunk header
-            index_buffer_header += utils.pack_int(len(face_data)*2)  # length of chunk is 2*(3*face_count)
-            file.write(index_buffer_header)
-            for face in face_data:
-                file.write(utils.pack_u_short(face))
+            index_buffer_header += utils.pack_int(len(indices)*2)  # length of chunk is 2*(3*face_count)
+            file.write(index_buffer_header + indices.astype('<u2').tobytes())
 
         #uses mesh vertices, bmesh uses different data layout
         def getMaxWeightGroupIndex(vertex):
@@ -620,7 +646,13 @@ class ALO_Exporter(bpy.types.Operator):
                 vertex_face_data = submesh_vertex_face_data(bm, object, material, uses_bump, mesh)
 
             vertices = vertex_face_data[0]
-            face_indices = vertex_face_data[1]
+            face_indices = np.array(vertex_face_data[1], dtype=np.int64)
+
+            #indices are stored as unsigned shorts, check before anything of the submesh is written
+            if len(face_indices) > 0 and face_indices.max() > 65535:
+                bm.free()
+                cleanUpModifiers(object)
+                raise RuntimeError('Too many vertices on object: ' + object.name + ' (' + str(len(vertices)) + ' vertices in one submesh, at most 65536 are supported)')
 
             create_sub_mesh_info_chunk(len(vertices), len(face_indices))
             create_vertex_format_chunk(material)
@@ -654,74 +686,34 @@ class ALO_Exporter(bpy.types.Operator):
         def create_vertex_buffer(vertices, shader):
 
             chunk_header = b"\x07\x00\x01\00"
-            chunk_header += utils.pack_int(len(vertices)*144)
-            file.write(chunk_header)
+            chunk_header += utils.pack_int(len(vertices)*utils.vertex_dtype.itemsize)
 
-            for vertex in vertices:
+            def normalized(vectors):
+                #zero vectors stay zero, like mathutils normalized()
+                vectors = np.array(vectors, dtype=np.float64).reshape(-1, 3)
+                lengths = np.linalg.norm(vectors, axis=1)
+                lengths[lengths == 0] = 1
+                return vectors / lengths[:, None]
 
-                #location
-                file.write(utils.pack_float(vertex.co[0]))
-                file.write(utils.pack_float(vertex.co[1]))
-                file.write(utils.pack_float(vertex.co[2]))
+            #all fields not set here are unused and stay zero
+            buffer = np.zeros(len(vertices), dtype=utils.vertex_dtype)
+            buffer['co'] = np.array([vertex.co[:] for vertex in vertices]).reshape(-1, 3)
+            buffer['normal'] = normalized([vertex.normal[:] for vertex in vertices])
 
-                #normal
-                normal = vertex.normal.normalized()
-                file.write(utils.pack_float(normal[0]))
-                file.write(utils.pack_float(normal[1]))
-                file.write(utils.pack_float(normal[2]))
+            uvs = np.array([vertex.uv[:] for vertex in vertices]).reshape(-1, 2)
+            buffer['uv'][:, 0, 0] = uvs[:, 0]
+            buffer['uv'][:, 0, 1] = -uvs[:, 1]  #second UV mirrored in alo format
 
+            buffer['tangent'] = normalized([vertex.tangent[:] for vertex in vertices])
+            buffer['bitangent'] = normalized([vertex.bitangent[:] for vertex in vertices])
 
-                #UVs
-                file.write(utils.pack_float( vertex.uv[0]))
-                file.write(utils.pack_float(-vertex.uv[1])) #second UV mirrored in alo format
+            buffer['color'] = 1
 
-                #unused UVs
-                counter = 0
-                while (counter<6):
-                    file.write(utils.pack_int(0))
-                    counter += 1
-
-                tangent   = vertex.tangent
-                bitangent = vertex.bitangent
-
-                tangent.normalize()
-                bitangent.normalize()
-
-                file.write(utils.pack_float(tangent.x))
-                file.write(utils.pack_float(tangent.y))
-                file.write(utils.pack_float(tangent.z))
-
-                file.write(utils.pack_float(bitangent.x))
-                file.write(utils.pack_float(bitangent.y))
-                file.write(utils.pack_float(bitangent.z))
+            #one bone per vertex, weight is always 1
+            buffer['bone_index'][:, 0] = [vertex.bone_index for vertex in vertices]
+            buffer['bone_weight'][:, 0] = 1
 
-                #color
-                file.write(utils.pack_float(1))
-                file.write(utils.pack_float(1))
-                file.write(utils.pack_float(1))
-                file.write(utils.pack_float(1))
-
-                #unused
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-
-                #bone indices
-                file.write(utils.pack_int(vertex.bone_index))
-
-                #unused bone indices
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-
-                #bone weight, always 1
-                file.write(utils.pack_float(1))
-
-                #unused bone weights
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
-                file.write(utils.pack_int(0))
+            file.write(chunk_header + buffer.tobytes())
 
         def create_sub_mesh_info_chunk(vertex_number, face_number):
             sub_mesh_information_chunk = b"\x01\x00\x01\00"  # add chunk header
@@ -1446,11 +1438,35 @@ class ALO_Exporter(bpy.types.Operator):
             path = filePath[0:fileNameIndex]
             fileName = filePath[fileNameIndex:]
 
-            exporter = export_ala.AnimationExporter()
-
-            for action in bpy.data.actions:
-                arm.animation_data.action = action
-                exporter.exportAnimation(filePath + "_" + action.name + ".ALA")
+            exporter = export_ala.AnimationExporter(self.evaluateFCurves, self.isolateArmature)
+
+            #the manifest stores a hash of every exported action, unchanged actions are not exported again
+            manifestPath = filePath + "_ALA_manifest.json"
+            manifest = {}
+            if self.skipUnchangedAnimations:
+                manifest = export_ala.load_manifest(manifestPath)
+            exported = {}
+
+            activeAction = arm.animation_data.action
+            try:
+                for action in bpy.data.actions:
+                    if not export_ala.action_targets_armature(action, arm):
+                        continue
+                    animationPath = filePath + "_" + action.name + ".ALA"
+                    hash = export_ala.animation_hash(action, arm)
+                    exported[action.name] = {'hash': hash, 'file': os.path.basename(animationPath)}
+
+                    entry = manifest.get(action.name)
+                    if entry != None and entry.get('hash') == hash and os.path.isfile(animationPath):
+                        continue
+
+                    arm.animation_data.action = action
+                    exporter.exportAnimation(animationPath)
+            finally:
+                #restore the active action even if an export fails
+                arm.animation_data.action = activeAction
+
+            export_ala.save_manifest(manifestPath, exported)
 
 
         mesh_list = create_export_list(bpy.context.scene.collection)
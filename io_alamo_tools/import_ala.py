@@ -22,7 +22,7 @@ from bpy_extras.io_utils import ExportHelper, ImportHelper
 import sys
 import os
 import bmesh
-import binascii
+import numpy as np
 
 class animation_data():
         def __init__(self):
@@ -36,10 +36,9 @@ class animation_data():
 
             self.translation_offset = []
             self.translation_index = []
-            self.translation_data = []
             self.translation_block_size = 0
             self.translation_scale = []
-            self.translation_data = []
+            self.translation_data = None    #(frames, block size, 3) array of quantized translations
 
             self.scaleIndex = []
             self.scale_offset = []
@@ -47,7 +46,7 @@ class animation_data():
             self.rotation_index = []
             self.default_rotation = []
             self.rotation_block_size = 0
-            self.rotation_data = []
+            self.rotation_data = None    #(frames, block size, 4) array of w, x, y, z quaternions
 
             self.visibilityAnimation = []
             self.visibilityDict = {}
@@ -62,25 +61,14 @@ def read_length(file):
 def read_visibility_data(data, bone_Name):
     length = struct.unpack("<I",file.read(4))[0]
 
-    bytes = file.read(length)
-    string = str(binascii.hexlify(bytes))[2:-1]
-
-    string = string.replace('x', '').replace('b', '').replace('\\', '').replace('\'', '')#.replace('<', '')
-    binary = ''
-    counter = 0
-
-    while counter < len(string):
-        slice = string[counter:counter+1]
-        slice += string[counter+1:counter+2]
-        binary_part = bin(int(slice, 16))[2:].zfill(8)
-        binaryReverse = binary_part[::-1] #file is little endian, reverse byte
-        binary += binaryReverse
-        counter += 2
+    #one bit per frame, set if the bone is visible, least significant bit first
+    bytes = np.frombuffer(file.read(length), dtype=np.uint8)
+    visibility = np.unpackbits(bytes, bitorder='little').astype(bool)
 
     if bone_Name in data.visibilityDict:
         bone_Name += ".001"
         counter = 2
-        while bone_Name in visibilityDict:
+        while bone_Name in data.visibilityDict:
             if counter < 10:
                 bone_Name = bone_Name[0:len(bone_Name)-4] + ".00" + str(counter)
             elif counter < 100:
@@ -88,34 +76,45 @@ def read_visibility_data(data, bone_Name):
             else:
                 bone_Name = bone_Name[0:len(bone_Name)-4] + "." + str(counter)
             counter += 1
-    data.visibilityDict[bone_Name] = binary
+    data.visibilityDict[bone_Name] = visibility
 
 def read_translation_data(data):
-    counter_limit = data.num_frames * data.translation_block_size * 3
-    counter = 0
-    while (counter < counter_limit):
-        vector = mathutils.Vector((0, 0, 0))
-        vector[0] = utils.read_u_short(file.read(2))
-        vector[1] = utils.read_u_short(file.read(2))
-        vector[2] = utils.read_u_short(file.read(2))
-        data.translation_data.append(vector)
-        counter += 3
+    #translations are stored as unsigned shorts, one block of x, y, z per frame
+    count = data.num_frames * data.translation_block_size * 3
+    translations = np.frombuffer(file.read(count * 2), dtype='<u2', count=count)
+    data.translation_data = translations.reshape(data.num_frames, data.translation_block_size, 3)
 
 def read_rotation_data(data):
-    counter_limit = data.num_frames * data.rotation_block_size * 4
-    counter = 0
-    while (counter < counter_limit):
-        q = mathutils.Quaternion()
-        q[1] = utils.read_short(file.read(2))
-        q[2] = utils.read_short(file.read(2))
-        q[3] = utils.read_short(file.read(2))
-        q[0] = utils.read_short(file.read(2))
-
-        for i in range(4):
-            q[i] = q[i] / 32767.0
-
-        data.rotation_data.append(q)
-        counter += 4
+    #rotations are stored as signed shorts in x, y, z, w order, one block per frame
+    count = data.num_frames * data.rotation_block_size * 4
+    rotations = np.frombuffer(file.read(count * 2), dtype='<i2', count=count)
+    rotations = rotations.reshape(data.num_frames, data.rotation_block_size, 4)
+    data.rotation_data = rotations[:, :, [3, 0, 1, 2]] / 32767.0
+
+def get_bone_locations(data):
+    #returns (frames, bones, 3) locations, static bones only use their offset
+    offsets = np.array(data.translation_offset, dtype=np.float64).reshape(-1, 3)
+    locations = np.broadcast_to(offsets, (data.num_frames, data.num_bones, 3)).copy()
+
+    translation_index = np.array(data.translation_index, dtype=np.int64)
+    animated = np.flatnonzero(translation_index != -1)
+    if len(animated) > 0:
+        #translation index counts floats, data is stored per vector, thats why divide by 3
+        slots = translation_index[animated] // 3
+        scales = np.array(data.translation_scale, dtype=np.float64).reshape(-1, 3)[animated]
+        locations[:, animated] += data.translation_data[:, slots] * scales
+    return locations
+
+def get_bone_rotations(data):
+    #returns (frames, bones, 4) quaternions, static bones use their default rotation
+    defaults = np.array(data.default_rotation, dtype=np.float64).reshape(-1, 4)
+    rotations = np.broadcast_to(defaults, (data.num_frames, data.num_bones, 4)).copy()
+
+    rotation_index = np.array(data.rotation_index, dtype=np.int64)
+    animated = np.flatnonzero(rotation_index != -1)
+    if len(animated) > 0:
+        rotations[:, animated] = data.rotation_data[:, rotation_index[animated]]
+    return rotations
 
 def read_next_chunk(path):
     data = animation_data()
@@ -157,16 +156,8 @@ def read_animation_information(data):
     data.scale_block_size = utils.read_int(file.read(4))
 
 def read_bone_name(data):
-    bytes = file.read(1) + bytearray(3)
-    length = struct.unpack("<I", bytes)[0]  # get string length
-    boneName = ""
-    counter = 0
-    while counter < length - 1:
-        letter = str(file.read(1))
-        letter = letter[2:len(letter) - 1]
-        boneName += letter
-        counter += 1
-    file.seek(1, 1)  # skip end byte of name
+    length = file.read(1)[0]  # get string length
+    boneName = utils.read_string(file, length)
     if boneName in data.visibilityDict:
         boneName += ".001"
         counter = 2
@@ -273,7 +264,49 @@ def read_bone_animation_info(data):
     else:
         file.seek(-4,1)
 
-def create_animation(data):
+def create_fcurve(action, data_path, index, group, frames, values, interpolation):
+    #fill a new fcurve with one keyframe per frame, without evaluating the scene
+    fcurve = action.fcurves.new(data_path, index=index, action_group=group)
+    keyframes = fcurve.keyframe_points
+    keyframes.add(len(frames))
+    co = np.empty((len(frames), 2), dtype=np.float32)
+    co[:, 0] = frames
+    co[:, 1] = values
+    keyframes.foreach_set('co', co.ravel())
+    keyframes.foreach_set('interpolation', np.full(len(frames), utils.keyframe_interpolation[interpolation], dtype=np.int32))
+    fcurve.update()
+    return fcurve
+
+def reduce_keyframes(values, tolerance):
+    #returns the indices of the samples to key, dropped samples are reproduced
+    #by linear interpolation between the kept ones within tolerance
+    #values holds one row per sample, all components of a track are reduced together
+    count = len(values)
+    if count <= 2:
+        return np.arange(count)
+
+    keep = [0]
+    anchor = 0
+    end = 2
+    while end < count:
+        span = values[anchor:end + 1]
+        t = np.linspace(0, 1, end - anchor + 1)[:, None]
+        interpolated = span[0] + (span[-1] - span[0]) * t
+        if np.abs(interpolated - span).max() > tolerance:
+            #sample before end is needed to stay within tolerance
+            anchor = end - 1
+            keep.append(anchor)
+        end += 1
+    keep.append(count - 1)
+    return np.array(keep)
+
+def reduce_constant_keyframes(values):
+    #with constant interpolation only the samples where the value changes are needed
+    values = np.asarray(values)
+    changes = np.flatnonzero(values[1:] != values[:-1]) + 1
+    return np.concatenate(([0], changes))
+
+def create_animation(data, reduceKeyframes=False, tolerance=0.0001):
     action = utils.getCurrentAction()
     action.AnimationEndFrame = data.num_frames-1
     action.use_fake_user = True
@@ -282,66 +315,80 @@ def create_animation(data):
     scene.frame_start = 0
     scene.frame_end = data.num_frames-1
     scene.render.fps = data.fps
-    scene.frame_set(0)
-
-    utils.setModeToObject()
 
     armature = utils.findArmature()
-    armature.select_set(True)  # select the skeleton
-    bpy.context.view_layer.objects.active = armature
-
-    bpy.ops.object.mode_set(mode='POSE')  # enter pose mode
-
-    bpy.ops.pose.rot_clear()
-    bpy.ops.pose.scale_clear()
-    bpy.ops.pose.transforms_clear()
-
-    fps_counter = 0 #initialize fps_counter, coresponds to current animation frame
-
-    while fps_counter < data.num_frames:
-        bone_counter = 0
-        while bone_counter < data.num_bones:
-            #unpack data
-            if data.rotation_index[bone_counter] != -1:
-                rotation_unpacked = data.rotation_data[fps_counter * data.rotation_block_size + data.rotation_index[bone_counter]]
-            else:
-                rotation_unpacked = data.default_rotation[bone_counter]
-
-            offset = data.translation_offset[bone_counter]
-            if data.translation_index[bone_counter] != -1:
-                scale = data.translation_scale[bone_counter]
-                t_packed = data.translation_data[fps_counter * data.translation_block_size + int(data.translation_index[bone_counter] / 3)] #translation index counts floats, data is stored as vector, thats why divide by 3
-                for i in range(3):
-                    t_packed[i] = t_packed[i] * scale[i]
-                location_unpacked = offset + t_packed
-            else:
-                location_unpacked = offset
 
-            translationMatrix = mathutils.Matrix.Translation(location_unpacked).to_4x4()
-            rotationMatrix = rotation_unpacked.to_matrix().to_4x4()
-
-            if data.bone_name_list[data.bone_index[bone_counter]-1] in armature.pose.bones:
-                pose = armature.pose.bones[data.bone_name_list[bone_counter]]  #pose bone of current bone
-                bone = armature.data.bones[data.bone_name_list[bone_counter]]    #bone of current bone
-
-                if(pose.parent != None):
-                    pose.matrix = pose.parent.matrix @ translationMatrix @ rotationMatrix
-                else:
-                    pose.matrix = translationMatrix @ rotationMatrix
-
-                if data.rotation_index[bone_counter] != -1 or fps_counter == 0 or fps_counter == data.num_frames - 1:
-                     pose.keyframe_insert(data_path='rotation_quaternion')
-
-                if data.translation_index[bone_counter] != -1:
-                    pose.keyframe_insert(data_path='location')
-
-                if bone.name in data.visibilityDict:
-                    pose.proxyIsHiddenAnimation = (data.visibilityDict[pose.name][scene.frame_current] == '0')
-                    pose.keyframe_insert(data_path='proxyIsHiddenAnimation')
+    #clear the pose, channels without keyframes must not keep the values of a previous pose
+    for pose in armature.pose.bones:
+        pose.matrix_basis = mathutils.Matrix()
+
+    locations = get_bone_locations(data)
+    rotations = get_bone_rotations(data)
+
+    #the file stores transforms relative to the parent bone, blender keys them relative to the rest pose:
+    #matrix_basis = rest^-1 @ parent_rest @ translation @ rotation
+    bone_names = []
+    bone_columns = []
+    rest_rotations = []
+    rest_quaternions = []
+    rest_translations = []
+    for bone_counter in range(data.num_bones):
+        name = data.bone_name_list[bone_counter]
+        if name not in armature.pose.bones:
+            continue
+        bone = armature.data.bones[name]
+        rest = bone.matrix_local.inverted()
+        if bone.parent != None:
+            rest = rest @ bone.parent.matrix_local
+        bone_names.append(name)
+        bone_columns.append(bone_counter)
+        rotation, quaternion, translation = utils.decompose_rigid(rest)
+        rest_rotations.append(rotation)
+        rest_quaternions.append(quaternion)
+        rest_translations.append(translation)
+
+    if len(bone_names) == 0:
+        return
+
+    rest_rotations = np.array(rest_rotations)
+    rest_quaternions = np.array(rest_quaternions)
+    rest_translations = np.array(rest_translations)
+
+    locations = np.einsum('bij,fbj->fbi', rest_rotations, locations[:, bone_columns]) + rest_translations
+    rotations = utils.quaternion_multiply(rest_quaternions, rotations[:, bone_columns])
+
+    frames = np.arange(data.num_frames)
+    ends = np.unique([0, data.num_frames - 1])    #static rotations and translations are keyed on the first and last frame
+
+    for column, name in enumerate(bone_names):
+        bone_counter = bone_columns[column]
+        path = 'pose.bones["' + name + '"]'
+
+        if data.rotation_index[bone_counter] != -1:
+            rotationFrames = frames
+        else:
+            rotationFrames = ends
+        if reduceKeyframes:
+            rotationFrames = rotationFrames[reduce_keyframes(rotations[rotationFrames, column], tolerance)]
+        for i in range(4):
+            create_fcurve(action, path + '.rotation_quaternion', i, name, rotationFrames, rotations[rotationFrames, column, i], 'LINEAR')
+
+        if data.translation_index[bone_counter] != -1:
+            locationFrames = frames
+        else:
+            locationFrames = ends
+        if reduceKeyframes:
+            locationFrames = locationFrames[reduce_keyframes(locations[locationFrames, column], tolerance)]
+        for i in range(3):
+            create_fcurve(action, path + '.location', i, name, locationFrames, locations[locationFrames, column, i], 'LINEAR')
+
+        if name in data.visibilityDict:
+            hidden = ~data.visibilityDict[name][frames]
+            visibilityFrames = frames
+            if reduceKeyframes:
+                visibilityFrames = frames[reduce_constant_keyframes(hidden)]
+            create_fcurve(action, path + '.proxyIsHiddenAnimation', 0, name, visibilityFrames, hidden[visibilityFrames], 'CONSTANT')
 
-            bone_counter += 1
-        fps_counter += 1
-        scene.frame_set(scene.frame_current + 1)
     scene.frame_set(0)
 
 def validate(data):
@@ -357,6 +404,11 @@ def validate(data):
         return False
 
 class AnimationImporter():
+    def __init__(self, reduceKeyframes=False, tolerance=0.0001):
+        #drop keyframes that interpolation between their neighbours reproduces within tolerance
+        self.reduceKeyframes = reduceKeyframes
+        self.tolerance = tolerance
+
     def loadAnimation(self, filePath):
             global file
             file = open(filePath, 'rb') # 'rb' - open for reading in binary mode
@@ -382,7 +434,7 @@ class AnimationImporter():
                     arm.animation_data_create()
                 arm.animation_data.action = action
 
-                create_animation(data)
+                create_animation(data, self.reduceKeyframes, self.tolerance)
 
 class ALA_Importer(bpy.types.Operator):
     """ALA Importer"""      # blender will use this as a tooltip for menu items and buttons.
@@ -398,9 +450,31 @@ class ALA_Importer(bpy.types.Operator):
 
     filepath : StringProperty(name="File Path", description="Filepathused for importing the ALA file", maxlen=1024, default="")
 
+    reduceKeyframes : BoolProperty(
+            name="Reduce Keyframes",
+            description="Only keep keyframes that can't be interpolated from their neighbours",
+            default=False,
+            )
+
+    keyframeTolerance : FloatProperty(
+            name="Tolerance",
+            description="Maximum deviation of dropped keyframes from the interpolated animation",
+            default=0.0001,
+            min=0.0,
+            precision=5,
+            )
+
+    def draw(self, context):
+        layout = self.layout
+
+        layout.prop(self, "reduceKeyframes")
+        row = layout.row()
+        row.enabled = self.reduceKeyframes
+        row.prop(self, "keyframeTolerance")
+
     def execute(self, context):        # execute() is called by blender when running the operator.
 
-        importer = AnimationImporter()
+        importer = AnimationImporter(self.reduceKeyframes, self.keyframeTolerance)
         animPath = self.properties.filepath
         importer.loadAnimation(animPath)
         utils.setModeToObject()
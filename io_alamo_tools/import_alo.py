@@ -1,5 +1,5 @@
 import bpy
-from . import settings, utils, import_ala
+from . import settings, utils, import_ala, chunk_reader
 
 from bpy.props import (StringProperty,
                        BoolProperty,
@@ -14,6 +14,7 @@ from bpy.types import (Panel,
                        )
 import struct
 import mathutils
+import numpy as np
 import math
 from math import pi
 from mathutils import Vector
@@ -23,6 +24,76 @@ import sys
 import os
 from os import listdir
 import bmesh
+import hashlib
+
+#0x206 bone chunk: parent index, visible, billboard mode and a 3x4 matrix
+bone_struct = struct.Struct("<3I12f")
+
+#every material parameter used by a shader in settings
+material_parameters = {parameter for parameters in settings.material_parameter_dict.values() for parameter in parameters if parameter != ""}
+#registered material properties that no shader in settings lists
+material_parameters |= {"DiffuseColor"}
+
+#value layout of the material parameter chunks, 0x10105 holds a texture name instead
+material_parameter_structs = {
+    0x10102: struct.Struct("<I"),
+    0x10103: struct.Struct("<f"),
+    0x10104: struct.Struct("<3f"),
+    0x10106: struct.Struct("<4f"),
+}
+
+#hash of a raw 0x10100 material chunk -> name of the material created for it
+#identical material chunks reuse that material, across submeshes and imports
+material_cache = {}
+
+#texture folder -> (modification time, lowercase file name -> path)
+#a folder is only scanned again when its modification time changes
+texture_folder_cache = {}
+
+def index_texture_folder(folder):
+    try:
+        mtime = os.stat(folder).st_mtime
+    except OSError:
+        return {}
+
+    cached = texture_folder_cache.get(folder)
+    if cached != None and cached[0] == mtime:
+        return cached[1]
+
+    index = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                index.setdefault(entry.name.lower(), entry.path)
+    texture_folder_cache[folder] = (mtime, index)
+    return index
+
+def find_folder(parent, name):
+    #case insensitive lookup of a sub folder, mod folders don't have consistent capitalization
+    try:
+        with os.scandir(parent) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.name.lower() == name.lower():
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+class TextureIndex():
+    #resolves texture names case insensitively, earlier folders take precedence
+    def __init__(self, folders):
+        self.paths = {}
+        for folder in reversed(folders):
+            self.paths.update(index_texture_folder(folder))
+        self.missing = set()
+
+    def find(self, texture_name):
+        name = texture_name.lower()
+        path = self.paths.get(name)
+        if path == None and name not in self.missing:
+            self.missing.add(name)
+            print("Couldn't find texture: " + texture_name)
+        return path
 
 def boneEnumCallback(scene, context):
     bones = [('None', 'None', '', '', 0)]
@@ -59,11 +130,38 @@ class ALO_Importer(bpy.types.Operator):
             default=True,
             )
 
+    reduceKeyframes : BoolProperty(
+            name="Reduce Keyframes",
+            description="Only keep animation keyframes that can't be interpolated from their neighbours",
+            default=False,
+            )
+
+    keyframeTolerance : FloatProperty(
+            name="Tolerance",
+            description="Maximum deviation of dropped keyframes from the interpolated animation",
+            default=0.0001,
+            min=0.0,
+            precision=5,
+            )
+
+    textureFolders : StringProperty(
+            name="Texture Folders",
+            description="Additional folders that are searched for textures, separated by ';'",
+            default="",
+            )
+
     def draw(self, context):
         layout = self.layout
 
         layout.prop(self, "importAnimations")
+        row = layout.row()
+        row.enabled = self.importAnimations
+        row.prop(self, "reduceKeyframes")
+        row = layout.row()
+        row.enabled = self.importAnimations and self.reduceKeyframes
+        row.prop(self, "keyframeTolerance")
         layout.prop(self, "parentName")
+        layout.prop(self, "textureFolders")
 
     filepath : StringProperty(name="File Path", description="Filepath used for importing the ALO file", maxlen=1024, default="")
 
@@ -73,38 +171,37 @@ class ALO_Importer(bpy.types.Operator):
 
         def process_active_junk():
             meshNameList = []
-            #loop over file until end is reached
-            while(file.tell() < os.path.getsize(self.properties.filepath)):
-                active_chunk = file.read(4)
-                #print(active_chunk)
-                if active_chunk == b"\x00\x02\x00\00":
-                    armatureData = createArmature()
-                elif active_chunk == b"\x00\x04\x00\00":
-                    file.seek(4, 1) #skip size
-                    meshName = processMeshChunk()
+            #loop over the top level chunks of the index
+            for chunk in file.chunks:
+                file.seek(chunk.offset)
+                if chunk.id == 0x200:
+                    createArmature(chunk)
+                elif chunk.id == 0x400:
+                    meshName = processMeshChunk(chunk)
                     meshNameList.append(meshName)
-                elif active_chunk == b"\x00\x13\x00\00":    #light chunk is irrelevant
+                elif chunk.id == 0x1300:    #light chunk is irrelevant
                     print('WARNING: file contains light objects, these are not supported and might cause minor issues')
-                    size = read_chunk_length()
-                    file.seek(size, 1)  #skip to next chunk
-                elif active_chunk == b"\x00\x06\x00\00":
-                    file.seek(8, 1)  # skip size and next header
-                    n_objects_proxies = get_n_objects_n_proxies()
-                    n_objects = n_objects_proxies['n_objects']
-                    n_proxies = n_objects_proxies['n_proxies']
+                elif chunk.id == 0x600:
                     print('Found Connection Chunk')
-                elif active_chunk == b"\x02\x06\x00\00":
-                    file.seek(4, 1)  # skip size
-                    read_conncetion(armatureData, meshNameList)
-                elif active_chunk == b"\x03\x06\x00\00":
-                    read_proxy()
+                    for child in chunk.children:
+                        file.seek(child.offset)
+                        if child.id == 0x601:
+                            n_objects_proxies = get_n_objects_n_proxies()
+                            n_objects = n_objects_proxies['n_objects']
+                            n_proxies = n_objects_proxies['n_proxies']
+                        elif child.id == 0x602:
+                            read_conncetion(meshNameList)
+                        elif child.id == 0x603:
+                            read_proxy(child.size)
 
         #armature and bones
 
         class Armature():
             def __init__(self):
+                self.object = None
                 self.bones = []
                 self.boneCount = 0
+                self.proxies = []
 
         class Bone():
             def __init__(self):
@@ -114,24 +211,17 @@ class ALO_Importer(bpy.types.Operator):
                 self.billboard = 0
                 self.matrix = None
 
-        def removeShadowDoubles():
-            for object in bpy.data.objects:
-                if(object.type == 'MESH'):
-                    if(len(object.material_slots) <= 0): continue; #already existing objects might not have a material
-                    shader = object.material_slots[0].material.shaderList.shaderList
-                    if (shader == 'MeshCollision.fx' or shader == 'RSkinShadowVolume.fx' or shader == 'MeshShadowVolume.fx'):
-                        bpy.ops.object.select_all(action='DESELECT')
-
-                        bpy.context.view_layer.objects.active = object
-                        object.select_set(True)
-                        bpy.ops.object.mode_set(mode='EDIT')
-                        bpy.ops.mesh.select_all(action='SELECT')
-                        bpy.ops.mesh.remove_doubles()
-                        bpy.ops.object.mode_set(mode='OBJECT')
+        class Proxy():
+            def __init__(self):
+                self.name = ''
+                self.boneIndex = 0
+                self.isHidden = False
+                self.altDecreaseStayHidden = False
 
-        def createArmature():
+        def createArmature(chunk):
 
             global fileName
+            global armatureData
 
             #create armature
             armatureBlender = bpy.data.armatures.new(fileName + "Armature")
@@ -142,66 +232,89 @@ class ALO_Importer(bpy.types.Operator):
             # Link object to collection
             importCollection.objects.link(armatureObj)
             bpy.context.view_layer.objects.active = armatureObj
-            bpy.context.view_layer.update()
 
-            #adjust settings and enter edit-mode
-            armatureObj = bpy.context.object
+            #adjust settings, bones are created later in a single edit mode session
             armatureObj.show_in_front = True
-            utils.setModeToEdit()
-
             armatureBlender.display_type = 'STICK'
-            armatureData = Armature()
 
-            file.seek(4, 1)  # skip size
-            get_bone_count(armatureData)
+            armatureData = Armature()
+            armatureData.object = armatureObj
 
-            counter = 0
-            while (counter < armatureData.boneCount):
-                process_bone(armatureData)
-                counter += 1
+            for child in chunk.children:
+                file.seek(child.offset)
+                if child.id == 0x201:
+                    get_bone_count(armatureData)
+                elif child.id == 0x202:
+                    process_bone(armatureData, child)
 
+            #meshes and proxies reference bones by name before they exist, so the names have to be unique already
+            boneNames = set()
             for bone in armatureData.bones:
-                createBone(bone, armatureBlender, armatureData)
-
-            bpy.ops.object.mode_set(mode = 'OBJECT')
+                name = bone.name
+                counter = 1
+                while name in boneNames:
+                    name = bone.name + "." + str(counter).zfill(3)
+                    counter += 1
+                bone.name = name
+                boneNames.add(name)
 
             bpy.context.scene.ActiveSkeleton.skeletonEnum = armatureObj.name
 
-            return armatureData
+        def createBones():
+            #creates all bones and applies the proxy settings in one edit mode session, Root is left out
+            armatureObj = armatureData.object
+            armatureBlender = armatureObj.data
+
+            armatureObj.select_set(True)  # select the skeleton
+            bpy.context.view_layer.objects.active = armatureObj
+            utils.setModeToEdit()
+
+            for bone in armatureData.bones:
+                if bone.name != 'Root':
+                    createBone(bone, armatureBlender, armatureData)
+
+            for proxy in armatureData.proxies:
+                #Root is not created, proxies on it or on missing bones are skipped
+                boneName = None
+                if proxy.boneIndex < len(armatureData.bones):
+                    boneName = armatureData.bones[proxy.boneIndex].name
+                if boneName == None or boneName not in armatureBlender.edit_bones:
+                    print("Warning: proxy " + proxy.name + " is attached to a bone that isn't imported, skipping it")
+                    continue
+                bone = armatureBlender.edit_bones[boneName]
+                bone.EnableProxy = True
+                bone.ProxyName = proxy.name
+                bone.proxyIsHidden = proxy.isHidden
+                bone.altDecreaseStayHidden = proxy.altDecreaseStayHidden
+
+            utils.setModeToObject()
 
         def get_bone_count(armatureData):
-            file.seek(8,1) #skip header and size
             bone_count = struct.unpack("<I", file.read(4))[0]
             armatureData.boneCount = bone_count
-            file.seek(124,1) #skip padding
 
-        def process_bone(armatureData):
+        def process_bone(armatureData, chunk):
             bone = Bone()
             armatureData.bones.append(bone)
 
-            file.seek(12, 1)  #skip header and size and next header
-            bone.name = cut_string(read_string())
-            file.seek(8, 1)  #skip header and size
-            bone.parentIndex = struct.unpack('<I', file.read(4))[0]
+            for child in chunk.children:
+                file.seek(child.offset)
+                if child.id == 0x203:
+                    bone.name = cut_string(read_string(child.size))
+                elif child.id == 0x206:
+                    read_bone_data(bone)
+
+        def read_bone_data(bone):
+            #parent, visible, billboard and the first three rows of the bone matrix
+            values = bone_struct.unpack(file.read(bone_struct.size))
+            bone.parentIndex = values[0]
             if bone.name == 'Root':
                 bone.parentIndex = 0
-            bone.visible = struct.unpack('<I', file.read(4))[0]
-            bone.billboard = struct.unpack('<I', file.read(4))[0]
-            matrix1_1 = struct.unpack('<f', file.read(4))[0]
-            matrix1_2 = struct.unpack('<f', file.read(4))[0]
-            matrix1_3 = struct.unpack('<f', file.read(4))[0]
-            matrix1_4 = struct.unpack('<f', file.read(4))[0]
-            matrix2_1 = struct.unpack('<f', file.read(4))[0]
-            matrix2_2 = struct.unpack('<f', file.read(4))[0]
-            matrix2_3 = struct.unpack('<f', file.read(4))[0]
-            matrix2_4 = struct.unpack('<f', file.read(4))[0]
-            matrix3_1 = struct.unpack('<f', file.read(4))[0]
-            matrix3_2 = struct.unpack('<f', file.read(4))[0]
-            matrix3_3 = struct.unpack('<f', file.read(4))[0]
-            matrix3_4 = struct.unpack('<f', file.read(4))[0]
-            bone_row_1 = ((matrix1_1, matrix1_2, matrix1_3, matrix1_4))
-            bone_row_2 = ((matrix2_1, matrix2_2, matrix2_3, matrix2_4))
-            bone_row_3 = ((matrix3_1, matrix3_2, matrix3_3, matrix3_4))
+            bone.visible = values[1]
+            bone.billboard = values[2]
+            bone_row_1 = values[3:7]
+            bone_row_2 = values[7:11]
+            bone_row_3 = values[11:15]
             bone_row_4 = (0, 0, 0, 1)
             bone.matrix = ((bone_row_1), (bone_row_2), (bone_row_3), (bone_row_4))
 
@@ -226,8 +339,6 @@ class ALO_Importer(bpy.types.Operator):
 
             bone.billboardMode.billboardMode = billboardModeArray[boneData.billboard]
 
-            bpy.ops.object.mode_set(mode='EDIT')
-
         #mesh and material
 
         class meshClass():
@@ -249,54 +360,110 @@ class ALO_Importer(bpy.types.Operator):
                 self.nVertices = 0
                 self.nFaces = 0
                 self.shader = None
-                self.vertices = []
-                self.faces = []
+                self.vertices = np.empty((0, 3), dtype=np.float32)
+                self.normals = np.empty((0, 3), dtype=np.float32)
+                self.tangents = np.empty((0, 3), dtype=np.float32)
+                self.faces = np.empty((0, 3), dtype=np.int32)
                 self.faceOffset = 0
-                self.UVs = []
+                self.UVs = np.empty((0, 2), dtype=np.float32)
                 self.material = None
+                self.materialIndex = 0  #material slot of the mesh used by the submesh
                 self.animationMapping = []
-                self.boneIndex = []
+                self.boneIndex = np.empty(0, dtype=np.uint32)
 
         def construct_mesh(currentMesh):
 
-            vertices = []
-            faces = []
-            UVs = []
-            animationMapping = []
-            for subMesh in currentMesh.subMeshList:
-                vertices += subMesh.vertices
-                faces += subMesh.faces
-                UVs += subMesh.UVs
-                animationMapping += subMesh.animationMapping
+            vertices = np.concatenate([subMesh.vertices for subMesh in currentMesh.subMeshList])
+            faces = np.concatenate([subMesh.faces for subMesh in currentMesh.subMeshList])
+            UVs = np.concatenate([subMesh.UVs for subMesh in currentMesh.subMeshList])
+            vertex_bones = get_vertex_bones(currentMesh)
 
-            mesh.from_pydata(vertices, [], faces)
+            #submeshes with identical materials share a slot
+            face_counts = [len(subMesh.faces) for subMesh in currentMesh.subMeshList]
+            slots = [subMesh.materialIndex for subMesh in currentMesh.subMeshList]
+            material_indices = np.repeat(np.array(slots, dtype=np.int32), face_counts)
 
-            # Update mesh with new data
-            mesh.update(calc_edges=True)
+            loop_uvs = UVs[faces.ravel()]
+
+            #shadow and collision meshes store separate vertices per face, weld them before the mesh is created
+            shader = currentMesh.subMeshList[0].material.shaderList.shaderList
+            if shader in settings.shadowCollisionShaderList:
+                kept_vertices, faces, valid_faces = weld_vertices(vertices, faces)
+                vertices = vertices[kept_vertices]
+                vertex_bones = vertex_bones[kept_vertices]
+                faces = faces[valid_faces]
+                material_indices = material_indices[valid_faces]
+                loop_uvs = loop_uvs.reshape(-1, 3, 2)[valid_faces].reshape(-1, 2)
+
+            loop_vertices = faces.ravel()
+            n_faces = len(faces)
+
+            #allocate the geometry up front and fill it directly from the decoded buffers
+            mesh.vertices.add(len(vertices))
+            mesh.vertices.foreach_set("co", vertices.ravel())
+
+            mesh.loops.add(len(loop_vertices))
+            mesh.loops.foreach_set("vertex_index", loop_vertices)
 
-            polys = mesh.polygons
-            for p in polys:
-                p.use_smooth = True
+            mesh.polygons.add(n_faces)
+            mesh.polygons.foreach_set("loop_start", np.arange(0, len(loop_vertices), 3, dtype=np.int32))
+            mesh.polygons.foreach_set("loop_total", np.full(n_faces, 3, dtype=np.int32))
+            mesh.polygons.foreach_set("use_smooth", np.ones(n_faces, dtype=bool))
 
             #assign materials correctly
-            if currentMesh.nMaterials > 1:
-                currentSubMeshMaxFaceIndex = currentMesh.subMeshList[0].nFaces
-                subMeshCounter = 0
-                for face in mesh.polygons:
-                    if face.index >= currentSubMeshMaxFaceIndex:
-                        subMeshCounter += 1
-                        currentSubMeshMaxFaceIndex += currentMesh.subMeshList[subMeshCounter].nFaces
-                    face.material_index = subMeshCounter
+            mesh.polygons.foreach_set("material_index", material_indices)
+
+            # Update mesh with new data
+            mesh.update(calc_edges=True)
 
             # create UVs
-            createUVLayer("MainUV", UVs)
-            assign_vertex_groups(animationMapping, currentMesh)
+            createUVLayer("MainUV", loop_uvs)
+            assign_vertex_groups(currentMesh, vertex_bones)
 
             return mesh
 
-        def readMeshInfo(currentMesh):
-            file.seek(8, 1)  # skip size and header
+        def weld_vertices(vertices, faces):
+            #spatial hash merge, replaces remove doubles on shadow and collision meshes
+            #vertices closer than the merge distance are merged into the first of them, faces that collapse are marked as invalid
+            merge_distance = 0.0001  #default distance of remove doubles
+
+            #exact duplicates are merged first, they are most of the doubles
+            unique, first, inverse = np.unique(vertices, axis=0, return_index=True, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            order = np.argsort(first)   #visit positions in the original vertex order
+
+            #the cells are as large as the merge distance, so every match is in one of the 27 surrounding cells
+            cells = np.floor(unique / merge_distance).astype(np.int64).tolist()
+            positions = unique.tolist()
+            neighbours = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+            grid = {}
+            target = np.empty(len(unique), dtype=np.int64)
+            for index in order.tolist():
+                cx, cy, cz = cells[index]
+                px, py, pz = positions[index]
+                match = index
+                for dx, dy, dz in neighbours:
+                    for candidate in grid.get((cx + dx, cy + dy, cz + dz), ()):
+                        qx, qy, qz = positions[candidate]
+                        if (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2 <= merge_distance ** 2:
+                            match = candidate
+                            break
+                    if match != index:
+                        break
+                if match == index:
+                    grid.setdefault((cx, cy, cz), []).append(index)
+                target[index] = match
+
+            #kept vertices stay in their original order
+            kept = order[target[order] == order]
+            new_index = np.empty(len(unique), dtype=np.int64)
+            new_index[kept] = np.arange(len(kept))
 
+            faces = new_index[target[inverse]][faces].astype(np.int32)
+            valid_faces = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+            return first[kept], faces, valid_faces
+
+        def readMeshInfo(currentMesh):
             nMaterials = struct.unpack("I", file.read(4))[0]
             currentMesh.nMaterials = nMaterials
 
@@ -310,102 +477,92 @@ class ALO_Importer(bpy.types.Operator):
             if collision == 1:
                 currentMesh.collision = True
 
-            file.seek(88, 1)
             create_object(currentMesh)
 
-        def get_mesh_name():
-            file.seek(4, 1) #skip header
-            length = read_chunk_length()
-            counter = 0
-            mesh_name = ""
-            while counter < length - 1:
-                letter = str(file.read(1))
-                letter = letter[2:len(letter) - 1]
-                mesh_name += letter
-                counter += 1
-            file.seek(1, 1)  # skip end byte of name
-
-            return cut_string(mesh_name)
+        def get_mesh_name(length):
+            return cut_string(read_string(length))
 
         def get_n_vertices_n_primitives(currentSubMesh):
             currentSubMesh.nVertices = struct.unpack("<I", file.read(4))[0]
             currentSubMesh.nFaces = struct.unpack("<I", file.read(4))[0]
-            file.seek(120, 1)
 
-        def processMeshChunk():
-            #name chunk
+        def processMeshChunk(chunk):
             currentMesh = meshClass()
             meshList.append(currentMesh)
-            currentMesh.name = get_mesh_name()
-
-            readMeshInfo(currentMesh)
 
-            counter = 0
+            #every submesh consists of a material chunk followed by a mesh data chunk
             faceOffset = 0
-            while (counter < currentMesh.nMaterials):
-                currentSubMesh = subMeshClass()
-                currentMesh.subMeshList.append(currentSubMesh)
-
-                currentSubMesh.faceOffset = faceOffset
-                read_material_info_chunk(currentSubMesh)
-                read_mesh_data(currentSubMesh)
-                faceOffset += currentSubMesh.nVertices
-                counter += 1
+            for child in chunk.children:
+                file.seek(child.offset)
+                if child.id == 0x401:
+                    currentMesh.name = get_mesh_name(child.size)
+                elif child.id == 0x402:
+                    readMeshInfo(currentMesh)
+                elif child.id == 0x10100:
+                    currentSubMesh = subMeshClass()
+                    currentMesh.subMeshList.append(currentSubMesh)
+                    currentSubMesh.faceOffset = faceOffset
+                    read_material_info_chunk(currentSubMesh, child)
+                elif child.id == 0x10000:
+                    read_mesh_data(currentSubMesh, child)
+                    faceOffset += currentSubMesh.nVertices
 
             contructed_mesh = construct_mesh(currentMesh)
             name = contructed_mesh.name
             return name
 
-        def read_mesh_data(currentSubMesh):
-            file.seek(4,1)  #skip header
-            meshDataChunkSize = read_chunk_length()
-            currentPosition = file.tell()
-            while (file.tell() < currentPosition + meshDataChunkSize):
-                active_chunk = file.read(4)
-                if active_chunk == b"\x01\x00\x01\00":
-                    file.seek(4, 1)  # skip size, chunk is always 128 byte
+        def read_mesh_data(currentSubMesh, chunk):
+            for child in chunk.children:
+                file.seek(child.offset)
+                if child.id == 0x10001:
                     get_n_vertices_n_primitives(currentSubMesh)
-                elif active_chunk == b"\x02\x00\x01\00":
-                    size = read_chunk_length()
-                    file.seek(size, 1)  # skip to next chunk
-                elif active_chunk == b"\x04\x00\x01\00":
-                    file.seek(4, 1)  # skip size
-                    faces = process_index_buffer(currentSubMesh)
-                elif active_chunk == b"\x06\x00\x01\00":
-                    read_animation_mapping(currentSubMesh)
-                elif active_chunk == b"\x07\x00\x01\00":
-                    file.seek(4, 1)  # skip size
-                    vertex_data = process_vertex_buffer_2(False, currentSubMesh)
-                elif active_chunk == b"\x05\x00\x01\00":
-                    file.seek(4, 1)  # skip size
+                elif child.id == 0x10004:
+                    process_index_buffer(currentSubMesh, child)
+                elif child.id == 0x10006:
+                    read_animation_mapping(currentSubMesh, child.size)
+                elif child.id == 0x10007:
+                    process_vertex_buffer_2(False, currentSubMesh, child)
+                elif child.id == 0x10005:
                     # old version of the chunk
-                    vertex_data = process_vertex_buffer_2(True, currentSubMesh)
-                elif active_chunk == b"\x00\x12\x00\00":
-                    size = read_chunk_length()
-                    file.seek(size, 1)  # skip to next chunk
-
-        def read_material_info_chunk(currentSubMesh):
-            file.seek(4,1) #skip header
-            materialChunkSize = read_chunk_length()
-            currentPosition = file.tell()
-            while (file.tell() < currentPosition + materialChunkSize):
-                active_chunk = file.read(4)
-                if active_chunk == b"\x01\x01\x01\00":
-                    create_material(currentSubMesh)
-                elif active_chunk == b"\x02\x01\x01\00":
-                    read_int(currentSubMesh.material)
-                elif active_chunk == b"\x03\x01\x01\00":
-                    read_float(currentSubMesh.material)
-                elif active_chunk == b"\x04\x01\x01\00":
-                    read_float3(currentSubMesh.material)
-                elif active_chunk == b"\x05\x01\x01\00":
+                    process_vertex_buffer_2(True, currentSubMesh, child)
+
+        def read_material_info_chunk(currentSubMesh, chunk):
+            chunkHash = hashlib.sha1(file.view(chunk.offset, chunk.size)).hexdigest()
+            material = get_cached_material(chunkHash)
+            if material != None:
+                #the exporter selects faces by material, so a mesh must not get the same material twice
+                materials = bpy.context.object.data.materials
+                currentSubMesh.materialIndex = materials.find(material.name)
+                if currentSubMesh.materialIndex == -1:
+                    materials.append(material)
+                    currentSubMesh.materialIndex = len(materials) - 1
+                currentSubMesh.material = material
+                return
+
+            for child in chunk.children:
+                file.seek(child.offset)
+                if child.id == 0x10101:
+                    create_material(currentSubMesh, child.size)
+                elif child.id in material_parameter_structs:
+                    read_material_parameter(currentSubMesh.material, material_parameter_structs[child.id])
+                elif child.id == 0x10105:
                     process_texture_chunk(currentSubMesh.material)
-                elif active_chunk == b"\x06\x01\x01\00":
-                    read_float4(currentSubMesh.material)
             set_up_textures(currentSubMesh.material)
 
-        def read_animation_mapping(currentSubMesh):
-            chunk_size = read_chunk_length()  # read chunk size
+            currentSubMesh.material['aloChunkHash'] = chunkHash
+            material_cache[chunkHash] = currentSubMesh.material.name
+
+        def get_cached_material(chunkHash):
+            #the material might have been deleted, renamed or replaced since it was cached
+            if chunkHash not in material_cache:
+                return None
+            material = bpy.data.materials.get(material_cache[chunkHash])
+            if material == None or material.get('aloChunkHash') != chunkHash:
+                del material_cache[chunkHash]
+                return None
+            return material
+
+        def read_animation_mapping(currentSubMesh, chunk_size):
             read_counter = chunk_size / 4
             counter = 0
             animation_mapping = []
@@ -492,79 +649,46 @@ class ALO_Importer(bpy.types.Operator):
             if (currentMesh.collision == 1):
                 object.HasCollision = True
 
-            #create vertex groups
-            armature = utils.findArmature()
-            for bone in armature.data.bones:
-                vertgroup = object.vertex_groups.new(name=bone.name)
-
-        def process_vertex_buffer_2(legacy, currentSubMesh):
-            f = struct.Struct('f')  # unpack as float
-            i = struct.Struct('I')
-            counter = 0
-            while counter < currentSubMesh.nVertices:
-                coX = f.unpack(file.read(4))[0]
-                coY = f.unpack(file.read(4))[0]
-                coZ = f.unpack(file.read(4))[0]
-                currentSubMesh.vertices.append(mathutils.Vector((coX, coY, coZ)))
-                file.seek(12, 1)
-                UV = []
-                UV.append(f.unpack(file.read(4))[0])
-                UV.append(f.unpack(file.read(4))[0] * (-1))
-                currentSubMesh.UVs.append(UV)
-                file.seek(64, 1)
-                if not legacy:
-                    file.seek(16, 1)
-                currentSubMesh.boneIndex.append(i.unpack(file.read(4))[0])
-                file.seek(28, 1)
-                counter += 1
-
-        def process_index_buffer(currentSubMesh):
-            h = struct.Struct('H')  # unpack as unsigned Short
-            counter = 0
-            while counter < currentSubMesh.nFaces:
-                face = []
-                face.append(h.unpack(file.read(2))[0] + currentSubMesh.faceOffset)
-                face.append(h.unpack(file.read(2))[0] + currentSubMesh.faceOffset)
-                face.append(h.unpack(file.read(2))[0] + currentSubMesh.faceOffset)
-                currentSubMesh.faces.append(face)
-                counter += 1
+        def process_vertex_buffer_2(legacy, currentSubMesh, chunk):
+            #decode the whole chunk at once, the structured dtype matches the vertex layout
+            if legacy:
+                vertex_dtype = utils.legacy_vertex_dtype
+            else:
+                vertex_dtype = utils.vertex_dtype
+            buffer = file.view(chunk.offset, chunk.size)
+            vertex_data = np.frombuffer(buffer, dtype=vertex_dtype, count=currentSubMesh.nVertices)
+
+            #copy every field, views would keep the file mapping alive after it is closed
+            currentSubMesh.vertices = np.array(vertex_data['co'], copy=True)
+            currentSubMesh.normals = np.array(vertex_data['normal'], copy=True)
+            currentSubMesh.tangents = np.array(vertex_data['tangent'], copy=True)
+            currentSubMesh.UVs = vertex_data['uv'][:, 0] * np.array((1, -1), dtype=np.float32)  #second UV mirrored in alo format
+            currentSubMesh.boneIndex = np.array(vertex_data['bone_index'][:, 0], copy=True)
+
+        def process_index_buffer(currentSubMesh, chunk):
+            #indices are stored as unsigned shorts, three per triangle
+            buffer = file.view(chunk.offset, chunk.size)
+            indices = np.frombuffer(buffer, dtype='<u2', count=currentSubMesh.nFaces * 3)
+            currentSubMesh.faces = indices.reshape(-1, 3).astype(np.int32) + currentSubMesh.faceOffset
 
         def process_texture_chunk(material):
-                file.seek(5, 1)  # skip chunk size and child header
-                length = struct.unpack("H", file.read(1) + b'\x00')  # get string length
-                global texture_function_name
-                texture_function_name = ""
-                counter = 0
-                while counter < length[0] - 1:
-                    letter = str(file.read(1))
-                    letter = letter[2:len(letter) - 1]
-                    texture_function_name = texture_function_name + letter
-                    counter += 1
-                file.seek(1, 1)  # skip string end byte
-                file.seek(1, 1)  # skip child header
-                length = struct.unpack("H", file.read(1) + b'\x00')  # get string length
-                texture_name = ""
-                counter = 0
-                while counter < length[0] - 1:
-                    letter = str(file.read(1))
-                    letter = letter[2:len(letter) - 1]
-                    texture_name = texture_name + letter
-                    counter += 1
+                texture_function_name = utils.read_mini_chunk_string(file)
+                texture_name = utils.read_mini_chunk_string(file)
                 # replace texture format with .dds
                 if texture_name != "None":
                     texture_name = texture_name[0:len(texture_name) - 4] + ".dds"
-                file.seek(1, 1)  # skip string end byte
 
                 load_image(texture_name)
-                exec('material.' + texture_function_name + '= texture_name')
+                if validate_material_prop(texture_function_name):
+                    setattr(material, texture_function_name, texture_name)
 
         def createUVLayer(layerName, uv_coordinates):
-            vert_uvs = uv_coordinates
-            mesh.uv_layers.new(name = layerName)
-            mesh.uv_layers[-1].data.foreach_set("uv", [uv for pair in [vert_uvs[l.vertex_index] for l in mesh.loops] for uv in pair])
+            #uv_coordinates holds one coordinate pair per loop
+            uv_layer = mesh.uv_layers.new(name = layerName)
+            uv_layer.data.foreach_set("uv", uv_coordinates.ravel())
 
-        def create_material(currentSubMesh):  # create material and assign
-            shaderName = read_string()
+        def create_material(currentSubMesh, length):  # create material and assign
+            shaderName = read_string(length)
             obj = bpy.context.object
             mat = bpy.data.materials.new(obj.name + "Material")
 
@@ -583,47 +707,59 @@ class ALO_Importer(bpy.types.Operator):
 
             obj.data.materials.append(mat)
             currentSubMesh.material = mat
+            currentSubMesh.materialIndex = len(obj.data.materials) - 1
+
+        def get_vertex_bones(currentMesh):
+            #the bone index of a vertex refers to the animation mapping of its own submesh
+            #vertices of submeshes without mapping are not skinned and get -1
+            vertex_bones = []
+            for subMesh in currentMesh.subMeshList:
+                if len(subMesh.animationMapping) != 0:
+                    mapping = np.array(subMesh.animationMapping, dtype=np.int64)
+                    vertex_bones.append(mapping[subMesh.boneIndex])
+                else:
+                    vertex_bones.append(np.full(len(subMesh.vertices), -1, dtype=np.int64))
+            return np.concatenate(vertex_bones)
 
-        def assign_vertex_groups(animation_mapping, currentMesh):
+        def assign_vertex_groups(currentMesh, vertex_bones):
             # assign vertex groups
             object = bpy.context.view_layer.objects.active
-            counter = 0
             armatureObject = utils.findArmature()
-            n_vertices = currentMesh.getNVerts()
 
-            bone_indices = []
+            #only bones referenced by an animation mapping get a vertex group
+            used_bones = set()
             for subMesh in currentMesh.subMeshList:
-                bone_indices += subMesh.boneIndex
+                used_bones.update(subMesh.animationMapping)
 
-            if(len(animation_mapping) != 0):
+            if len(used_bones) != 0 and armatureData != None:
                 # add armature modifier
                 mod = object.modifiers.new('MyRigModif', 'ARMATURE')
                 mod.object = armatureObject
                 mod.use_bone_envelopes = False
                 mod.use_vertex_groups = True
 
-                while counter < n_vertices:
-                    object.vertex_groups[animation_mapping[bone_indices[counter]]].add([counter], 1, 'ADD')
-                    counter += 1
+                #group vertices by bone, so every bone needs a single add() call
+                order = np.argsort(vertex_bones, kind='stable')
+                sorted_bones = vertex_bones[order]
+                for bone_index in sorted(used_bones):
+                    start = np.searchsorted(sorted_bones, bone_index, side='left')
+                    end = np.searchsorted(sorted_bones, bone_index, side='right')
+                    vertgroup = object.vertex_groups.new(name=armatureData.bones[bone_index].name)
+                    if end > start:
+                        vertgroup.add(order[start:end].tolist(), 1, 'ADD')
 
         #proxy and connection functions
 
         def get_n_objects_n_proxies():
-            size = read_chunk_length()
             file.seek(2, 1)
             n_objects = struct.unpack("l", file.read(4))
             file.seek(2, 1)
             n_proxies = struct.unpack("l", file.read(4))
             n_objects_proxies = {"n_objects": n_objects[0], "n_proxies": n_proxies[0]}
 
-            #some .alo formats have an additional unspecified value at this position
-            #to read the rest correctly this code checks if this is the case here and skips appropriately
-            size -= 12
-            file.seek(size, 1)
-
             return n_objects_proxies
 
-        def read_conncetion(armatureData, meshNameList):
+        def read_conncetion(meshNameList):
             file.seek(2, 1)  # skip head and size
             mesh_index = struct.unpack("I", file.read(4))[0]
             file.seek(2, 1)  # skip head and size
@@ -634,25 +770,18 @@ class ALO_Importer(bpy.types.Operator):
             obj = None
             if mesh_index < len(meshNameList):  #light objects can mess this up
                 obj = bpy.data.objects[meshNameList[mesh_index]]
-            bone = armatureBlender.data.bones[bone_index]
+            boneName = armatureData.bones[bone_index].name
             if obj != None:
-                if bone.name != 'Root':
+                if boneName != 'Root':
                     constraint = obj.constraints.new('CHILD_OF')
                     constraint.target = armatureBlender
-                    constraint.subtarget = bone.name
+                    constraint.subtarget = boneName
 
-        def read_proxy():
-            chunk_length = struct.unpack("I", file.read(4))[0]
+        def read_proxy(chunk_length):
             file.seek(1, 1)  # skip header
             name_length = struct.unpack("B", file.read(1))[0]
-            proxy_name = ""
-            counter = 0
-            while counter < name_length - 1:
-                letter = str(file.read(1))
-                letter = letter[2:len(letter) - 1]
-                proxy_name = proxy_name + letter
-                counter += 1
-            file.seek(3, 1)  # skip endbyte of name, chunk mini header and size
+            proxy_name = utils.read_string(file, name_length)
+            file.seek(2, 1)  # skip chunk mini header and size
             proxy_bone_index = struct.unpack("<I", file.read(4))[0]
 
             proxyIsHidden = False
@@ -669,26 +798,16 @@ class ALO_Importer(bpy.types.Operator):
                         altDecreaseStayHidden = True
                 counter += 6
 
-            armatureBlender = utils.findArmature()
-
-            bpy.context.view_layer.objects.active = armatureBlender
-            bpy.ops.object.mode_set(mode='EDIT')  # go to Edit mode
-            bone = armatureBlender.data.edit_bones[armatureBlender.data.bones[proxy_bone_index].name]
-            bone.EnableProxy = True
-            bone.ProxyName = proxy_name
-            bone.proxyIsHidden = proxyIsHidden
-            bone.altDecreaseStayHidden = altDecreaseStayHidden
-            bpy.ops.object.mode_set(mode='OBJECT')  # go to Edit mode
+            #applied together with the bones, see createBones()
+            proxy = Proxy()
+            proxy.name = proxy_name
+            proxy.boneIndex = proxy_bone_index
+            proxy.isHidden = proxyIsHidden
+            proxy.altDecreaseStayHidden = altDecreaseStayHidden
+            armatureData.proxies.append(proxy)
 
         #Utility functions
 
-        def read_chunk_length():
-            #the hight bit is used to tell if chunk holds data or chunks, so if it is set it has to be ignored when calculating length
-            length = struct.unpack("<I", file.read(4))[0]
-            if length >= 2147483648:
-                length -= 2147483648
-            return length
-
         def cut_string(string):
             #bones have a 63 character limit, this function cuts longer strings with space for .xyz end used by blender to distinguish double name
             if(len(string)> 63):
@@ -696,90 +815,41 @@ class ALO_Importer(bpy.types.Operator):
             else:
                 return string
 
-        def read_string():
+        def read_string(length):
             #reads string out of chunk containing only a string
-            length = struct.unpack("I", file.read(4))  # get string length
-            string = ""
-            counter = 0
-            while counter < length[0] - 1:
-                letter = str(file.read(1))
-                letter = letter[2:len(letter) - 1]
-                string = string + letter
-                counter += 1
-            file.seek(1, 1)  # skip end byte of name
-            return string
+            return utils.read_string(file, length)
 
         def read_string_mini_chunk():
-            file.seek(1,1)#skip chunk header
-            size = length = struct.unpack("<b", file.read(1))[0]
-            string = ""
-            counter = 0
-            while counter < length - 1:
-                letter = str(file.read(1))
-                letter = letter[2:len(letter) - 1]
-                string = string + letter
-                counter += 1
-            file.seek(1, 1)  # skip end byte of name
-            return string
-
-        def hideObject(object):
-
-            #set correct area type via context overwrite
-            context_override = bpy.context.copy()
-            area = None
-            for window in bpy.context.window_manager.windows:
-                screen = window.screen
-                for a in screen.areas:
-                    if a.type == 'VIEW_3D':
-                        area = a
-                        break
-
-            context_override['area'] = area
-
-            bpy.ops.object.select_all(context_override, action='DESELECT')
-            object.select_set(True)
-            bpy.ops.object.hide_view_set(context_override)
+            return utils.read_mini_chunk_string(file)
 
         def hideLODs():
-            #hides all but the most detailed LOD in Blender
-            for object in bpy.data.objects:
-                if(object.type == 'MESH'):
-                    #check if name ends with LOD
-                    if object.name[len(object.name)-4:len(object.name)-1] == 'LOD':
-                        #check for hightest LOD
-                        lodCounter = 0
-                        while (object.name[:-1]+str(lodCounter) in bpy.data.objects):
-                            lodCounter += 1
-                        #hide smaller LODS
-                        counter = 0
-                        while(counter < lodCounter-1):
-                            hideObject(bpy.data.objects[object.name[:-1] + str(counter)])
-                            counter += 1
-
-            #hide object if its a shadow or a collision
-            for object in bpy.data.objects:
-                if object.type == 'MESH':
-                    if len(object.material_slots) != 0:
-                        shader = object.material_slots[0].material.shaderList.shaderList
-                        if(shader == 'MeshCollision.fx' or shader == 'RSkinShadowVolume.fx' or shader == 'MeshShadowVolume.fx'):
-                            hideObject(object)
-
-            #hide objects that are set to not visible
-            for object in bpy.data.objects:
-                if (object.type == 'MESH'):
-                    if object.Hidden == True:
-                        hideObject(object)
-
-        def deleteRoot():
-            armature = utils.findArmature()
-            armature.select_set(True)  # select the skeleton
-            context.view_layer.objects.active  = armature
-
-            if bpy.ops.object.mode != 'EDIT':
-                bpy.ops.object.mode_set(mode='EDIT')
-            if 'Root' in armature.data.edit_bones:
-                armature.data.edit_bones.remove(armature.data.edit_bones['Root'])
-            bpy.ops.object.mode_set(mode='OBJECT')
+            #hides all but the most detailed LOD in Blender, as well as shadows, collisions and hidden objects
+            #only objects created by this import are considered
+            importedObjects = [bpy.data.objects[name] for name in MeshNameList]
+
+            #index LOD groups: name without LOD number -> LOD numbers
+            lodGroups = {}
+            for object in importedObjects:
+                if object.name[len(object.name)-4:len(object.name)-1] == 'LOD':
+                    lodGroups.setdefault(object.name[:-1], set()).add(object.name[-1])
+
+            hiddenNames = set()
+            for baseName, lods in lodGroups.items():
+                #check for hightest LOD
+                lodCounter = 0
+                while str(lodCounter) in lods:
+                    lodCounter += 1
+                #hide smaller LODS
+                for counter in range(lodCounter - 1):
+                    hiddenNames.add(baseName + str(counter))
+
+            for object in importedObjects:
+                hide = object.name in hiddenNames or object.Hidden
+                #hide object if its a shadow or a collision
+                if not hide and len(object.material_slots) != 0:
+                    hide = object.material_slots[0].material.shaderList.shaderList in settings.shadowCollisionShaderList
+                if hide:
+                    object.hide_set(True)
 
         # material utility functions
 
@@ -789,70 +859,41 @@ class ALO_Importer(bpy.types.Operator):
             elif (texture_name in bpy.data.images):
                 img = bpy.data.images[texture_name]
             else:
-                path = file.name
-                path = os.path.split(path)[0]
-                path = os.path.split(path)[0] + "/TEXTURES/" + texture_name
-                if os.path.isfile(path):
-                    img = bpy.data.images.load(path)
-                else:
-                    print("Couldn't find texture: " + texture_name)
+                path = textureIndex.find(texture_name)
+                if path == None:
                     return
+                img = bpy.data.images.load(path)
+                img.name = texture_name    #file name might differ in case, materials reference the texture name
+
+        def create_texture_index(filepath):
+            #textures are expected in ../TEXTURES relative to the model, followed by the configured folders
+            folders = []
+            artFolder = os.path.split(os.path.split(filepath)[0])[0]
+            defaultFolder = find_folder(artFolder, "TEXTURES")
+            if defaultFolder != None:
+                folders.append(defaultFolder)
+            for folder in self.textureFolders.split(';'):
+                folder = folder.strip()
+                if folder != "":
+                    folders.append(bpy.path.abspath(folder))
+            return TextureIndex(folders)
 
         def validate_material_prop(name):
-            material_props = ["BaseTexture", "NormalTexture", "GlossTexture", "WaveTexture", "DistortionTexture", "CloudTexture", "CloudNormalTexture", "Emissive", "Diffuse", "Specular","Shininess","Colorization" \
-                ,"DebugColor","UVOffset","Color","UVScrollRate","DiffuseColor","EdgeBrightness","BaseUVScale","WaveUVScale","DistortUVScale","BaseUVScrollRate","WaveUVScrollRate","DistortUVScrollRate","BendScale" \
-                , "Diffuse1","CloudScrollRate","CloudScale", "SFreq",  "TFreq", "DistortionScale", "Atmosphere", "CityColor", "AtmospherePower"]
-
-            if(name in material_props):
+            if(name in material_parameters):
                 return True
             else:
                 print("Unknown material porperty: " + name)
                 return False
 
-        def read_int(material):
-            file.seek(4, 1)  # skip size
-            name = read_string_mini_chunk()
-            file.seek(2, 1)  # skip mini header and size
-            value = struct.unpack('<I', file.read(4))[0]
-
-            if validate_material_prop(name):
-                exec('material.' + name + '= value')
-
-        def read_float(material):
-            file.seek(4, 1)  # skip size
-            name = read_string_mini_chunk()
-            file.seek(2, 1)  # skip mini header and size
-            value = struct.unpack('<f', file.read(4))[0]
-
-            if validate_material_prop(name):
-                exec('material.' + name + '= value')
-
-        def read_float3(material):
-            file.seek(4, 1)  # skip size
+        def read_material_parameter(material, value_struct):
             name = read_string_mini_chunk()
             file.seek(2, 1)  # skip mini header and size
-            value1 = struct.unpack('<f', file.read(4))[0]
-            value2 = struct.unpack('<f', file.read(4))[0]
-            value3 = struct.unpack('<f', file.read(4))[0]
-
-            value = (value1, value2, value3)
+            value = value_struct.unpack(file.read(value_struct.size))
+            if len(value) == 1:
+                value = value[0]
 
             if validate_material_prop(name):
-                exec('material.' + name + '= value')
-
-        def read_float4(material):
-            file.seek(4, 1)  # skip size
-            name = read_string_mini_chunk()
-            file.seek(2, 1)  # skip mini header and size
-            value1 = struct.unpack('<f', file.read(4))[0]
-            value2 = struct.unpack('<f', file.read(4))[0]
-            value3 = struct.unpack('<f', file.read(4))[0]
-            value4 = struct.unpack('<f', file.read(4))[0]
-
-            value = (value1, value2, value3, value4)
-
-            if validate_material_prop(name):
-                exec('material.' + name + '= value')
+                setattr(material, name, value)
 
         def setRenderToEevee():
             bpy.context.scene.render.engine = 'BLENDER_EEVEE'
@@ -872,7 +913,7 @@ class ALO_Importer(bpy.types.Operator):
                 if(fileExt.lower() == ".ala" and file[0:len(fileName)] == fileName):
                     animationFiles.append(file)
 
-            importer = import_ala.AnimationImporter()
+            importer = import_ala.AnimationImporter(self.reduceKeyframes, self.keyframeTolerance)
             arm = utils.findArmature()
             arm.animation_data_create()
 
@@ -893,6 +934,9 @@ class ALO_Importer(bpy.types.Operator):
         global meshList
         meshList = []
 
+        global armatureData
+        armatureData = None
+
         global fileName
         fileName = self.properties.filepath.split("\\")
         fileName = fileName[len(fileName) - 1]
@@ -910,12 +954,19 @@ class ALO_Importer(bpy.types.Operator):
 
         global file
         filepath = self.properties.filepath
-        file = open(filepath, 'rb') #open file in read binary mode
+
+        global textureIndex
+        textureIndex = create_texture_index(filepath)
+
+        file = chunk_reader.ChunkReader(filepath)
         setRenderToEevee()
-        process_active_junk()
-        removeShadowDoubles()
+        try:
+            process_active_junk()
+        finally:
+            file.close()
+        if armatureData != None:
+            createBones()
         hideLODs()
-        deleteRoot()
         if(self.importAnimations):
             loadAnimations(filepath)
 
@@ -77,6 +77,9 @@ billboard_array = {"Disable":0, "Parallel":1, "Face":2, "ZAxis View": 3, "ZAxis
 
 bumpMappingList = ['MeshBumpColorize.fx', 'MeshBumpColorizeVertex.fx', 'MeshBumpColorizeDetail.fx', "MeshBumpLight.fx", "Planet.fx", "RSkinBumpColorize.fx", "TerrainMeshBump.fx", "Tree.fx"]
 
+#meshes using these shaders are welded on import and hidden in Blender
+shadowCollisionShaderList = ['MeshCollision.fx', 'RSkinShadowVolume.fx', 'MeshShadowVolume.fx']
+
 rotation_curve_name = ['].rotation_quaternion', '].rotation_euler']
 
 #no_UV_Shaders = {"alDefault.fx", "MeshCollision.fx", "MeshShadowVolume.fx", "RSkinShadowVolume.fx"}
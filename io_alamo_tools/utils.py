@@ -1,6 +1,7 @@
 import bpy
 import struct
 import mathutils
+import numpy as np
 
 #utilities
 def findArmature():
@@ -71,6 +72,78 @@ def read_float(float):
 def read_int(int):
     return struct.unpack("<I", int)[0]
 
+#strings
+
+def decode_string(data):
+    #strings are null terminated, everything after the first null byte is ignored
+    data = bytes(data)
+    end = data.find(b"\x00")
+    if end != -1:
+        data = data[:end]
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        #files written by other tools may use a single byte code page
+        return data.decode('latin-1')
+
+def read_string(file, length):
+    #reads a string of length bytes, including the null terminator, with a single read
+    return decode_string(file.read(length))
+
+def read_mini_chunk_string(file):
+    #string stored in a mini chunk: 1 byte id, 1 byte length, null terminated string
+    file.seek(1, 1)  # skip mini chunk id
+    length = file.read(1)[0]
+    return read_string(file, length)
+
+#rotations
+
+def quaternion_multiply(a, b):
+    #hamilton product of w, x, y, z quaternion arrays
+    w1, x1, y1, z1 = np.moveaxis(a, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(b, -1, 0)
+    return np.stack((
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+    ), axis=-1)
+
+def decompose_rigid(matrix):
+    #splits a rest matrix into rotation matrix, w, x, y, z quaternion and translation numpy arrays, scale is removed
+    rotation = matrix.to_3x3().normalized()
+    return np.array(rotation), np.array(rotation.to_quaternion()), np.array(matrix.translation)
+
+#values of the keyframe interpolation enum, needed for foreach_get/foreach_set
+keyframe_interpolation = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+#vertex formats
+
+#layout of a vertex in the 0x10007 vertex buffer chunk, 144 bytes per vertex
+vertex_dtype = np.dtype([
+    ('co', '<f4', 3),
+    ('normal', '<f4', 3),
+    ('uv', '<f4', (4, 2)),  #only the first UV set is used, the others are zero
+    ('tangent', '<f4', 3),
+    ('bitangent', '<f4', 3),
+    ('color', '<f4', 4),
+    ('unused', '<u4', 4),
+    ('bone_index', '<u4', 4),
+    ('bone_weight', '<f4', 4),
+])
+
+#old version of the vertex buffer chunk (0x10005) lacks the unused block, 128 bytes per vertex
+legacy_vertex_dtype = np.dtype([
+    ('co', '<f4', 3),
+    ('normal', '<f4', 3),
+    ('uv', '<f4', (4, 2)),
+    ('tangent', '<f4', 3),
+    ('bitangent', '<f4', 3),
+    ('color', '<f4', 4),
+    ('bone_index', '<u4', 4),
+    ('bone_weight', '<f4', 4),
+])
+
 def even(n):
     if n % 2 == 0:
         return True